@@ -5,17 +5,28 @@
 # ======================
 # IMPORT
 # ======================
-import os, json, datetime, pytz, random
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
+import os, sys, csv, json, gzip, hashlib, secrets, argparse, asyncio, datetime, pytz, random, logging, shlex, subprocess
+import cProfile, tracemalloc, threading, functools, contextvars, tempfile
+import time as time_module
+from concurrent.futures import ProcessPoolExecutor
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from telegram.error import RetryAfter, BadRequest, TimedOut, NetworkError
+from telegram.ext import (
+    ApplicationBuilder, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler, ContextTypes,
+    MessageHandler, TypeHandler, filters
+)
 from reportlab.graphics.shapes import Drawing
 from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.charts.lineplots import LinePlot
 from reportlab.lib import colors
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+from pypdf import PdfWriter
 from datetime import time
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
 from zoneinfo import ZoneInfo
 
 
@@ -24,22 +35,131 @@ from zoneinfo import ZoneInfo
 # ======================
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 SHEET_ID = os.environ.get("SHEET_ID")
-GROUP_ID = int(os.environ.get("GROUP_ID"))
+GROUP_ID = int(os.environ["GROUP_ID"]) if os.environ.get("GROUP_ID") else None
+SCHOOL_NAME = os.environ.get("SCHOOL_NAME", "SK Labu Besar")
+
+# Berbilang sekolah dalam satu proses. Tanpa TENANTS_JSON, satu sekolah dibina dari
+# SHEET_ID / GROUP_ID / SCHOOL_NAME seperti biasa.
+# Jadual setiap sekolah: tab "Jadual" dalam sheet sekolah → "jadual" (fail) dalam spesifikasi → jadual.<id>.json
+TENANTS_JSON = os.environ.get("TENANTS_JSON")  # fail: [{"id", "nama", "sheet_id", "group_id", "kelas", "admin_ids", "guru_ids", "jadual"}, ...]
+TENANT_USERS_PATH = os.environ.get("TENANT_USERS_PATH", "sekolah_pengguna.json")
+TENANT_STAGGER = int(os.environ.get("TENANT_STAGGER", "120"))  # saat antara tugasan sekolah berturutan
+TENANT_STAGGER_WINDOW = int(os.environ.get("TENANT_STAGGER_WINDOW", "300"))  # semua ofset sekolah dalam tetingkap ini (saat)
+
+# Snapshot statik untuk dashboard (dijana semula selepas setiap simpanan). Fail ini hanya di cakera bot;
+# dashboard yang dihos statik memerlukan salah satu:
+#   - DASHBOARD_SNAPSHOT_PATH menghala ke folder yang dihidangkan oleh hos statik, atau
+#   - DASHBOARD_PUBLISH_CMD: arahan selepas setiap snapshot, {path} & {sekolah} diganti, cth.
+#       gsutil -h "Cache-Control:no-store" cp {path} gs://<bucket>/snapshot.{sekolah}.json
+#     dan buka dashboard dengan index.html?snapshot=<URL awam fail itu> (hos mesti benarkan CORS)
+DASHBOARD_SNAPSHOT_PATH = os.environ.get("DASHBOARD_SNAPSHOT_PATH", "dashboard/snapshot.json")
+DASHBOARD_SNAPSHOT_DELAY = int(os.environ.get("DASHBOARD_SNAPSHOT_DELAY", "30"))
+DASHBOARD_PUBLISH_CMD = os.environ.get("DASHBOARD_PUBLISH_CMD")
+DASHBOARD_PUBLISH_TIMEOUT = int(os.environ.get("DASHBOARD_PUBLISH_TIMEOUT", "60"))  # saat
+
+# Arkib rekod lama (fail jsonl.gz ikut bulan + worksheet "Arkib YYYY" jika ARCHIVE_SHEETS=1)
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "arkib")
+ARCHIVE_SHEETS = os.environ.get("ARCHIVE_SHEETS") == "1"
+
+# Laporan PDF bulanan / penggal
+REPORT_CACHE_DIR = os.environ.get("REPORT_CACHE_DIR", "/tmp/laporan_cache")
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "4"))
+PENGGAL_JSON = os.environ.get("PENGGAL_JSON")  # [{"nama": "Penggal 1", "mula": "DD/MM/YYYY", "tamat": "DD/MM/YYYY"}, ...]
+
+# Jadual tugasan (registry) & pentadbir
+JOBS_SHEET = os.environ.get("JOBS_SHEET", "Jadual")
+JOBS_FILE = os.environ.get("JOBS_FILE", "jadual.json")
+JOB_LOG_PATH = os.environ.get("JOB_LOG_PATH", "jadual_log.jsonl")
+JOB_SNAPSHOT_WINDOW = int(os.environ.get("JOB_SNAPSHOT_WINDOW", "300"))  # saat
+JOBS_RELOAD_INTERVAL = int(os.environ.get("JOBS_RELOAD_INTERVAL", "900"))  # saat
+ADMIN_IDS = {int(x) for x in os.environ.get("ADMIN_IDS", "").split(",") if x.strip()}
+
+# Cache senarai murid (saat)
+ROSTER_CACHE_TTL = int(os.environ.get("ROSTER_CACHE_TTL", "30"))
+
+# Paparan semak & kalendar guna salinan Kehadiran sehingga umur ini (saat);
+# simpanan melalui bot terus kelihatan, suntingan manual di sheet selepas tempoh ini
+KEHADIRAN_CACHE_TTL = int(os.environ.get("KEHADIRAN_CACHE_TTL", "10"))
+
+# Pengesanan perubahan: modifiedTime fail (Drive) disemak paling kerap setiap CHANGE_PROBE_INTERVAL saat;
+# sheet Kehadiran dibaca penuh hanya jika salinan tidak selari atau selepas KEHADIRAN_FULL_SYNC saat
+CHANGE_PROBE_INTERVAL = float(os.environ.get("CHANGE_PROBE_INTERVAL", "3"))
+KEHADIRAN_FULL_SYNC = int(os.environ.get("KEHADIRAN_FULL_SYNC", "1800"))
+KEHADIRAN_TAIL_OVERLAP = int(os.environ.get("KEHADIRAN_TAIL_OVERLAP", "3"))
+OWN_WRITES_KEPT = 256  # peralihan modifiedTime tulisan bot yang diingat
+
+# Bilangan maksimum paparan (teks & papan kekunci) yang disimpan dalam cache respons
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "512"))
+
+# Had masa setiap permintaan HTTP gspread, dan semakan "rekod sudah wujud" sebelum simpan (saat)
+SHEETS_TIMEOUT = float(os.environ.get("SHEETS_TIMEOUT", "20"))
+RECORD_CHECK_TIMEOUT = float(os.environ.get("RECORD_CHECK_TIMEOUT", "5"))
+
+# Masa menunggu sheet sedia semasa permulaan (saat)
+STARTUP_WAIT = int(os.environ.get("STARTUP_WAIT", "30"))
+
+# Jurnal tulis-dahulu: simpanan direkod di sini dahulu, kemudian disegerak ke Sheets
+JOURNAL_PATH = os.environ.get("JOURNAL_PATH", "jurnal_kehadiran.jsonl")
+JOURNAL_RETRY_MAX = int(os.environ.get("JOURNAL_RETRY_MAX", "300"))  # saat
+
+# Profiling pilihan (boleh juga dihidupkan semasa berjalan dengan /profil)
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "")
+PROFILE_TARGETS = os.environ.get("PROFILE_TARGETS", "*")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/profil")
+
+logger = logging.getLogger("kehadiran")
 
 
 # ======================
 # GOOGLE SHEET AUTH
 # ======================
+# Sambungan dibuka semasa fasa permulaan (init_sheets), bukan semasa import,
+# supaya modul boleh diimport tanpa rangkaian.
 scope = [
     "https://spreadsheets.google.com/feeds",
     "https://www.googleapis.com/auth/drive"
 ]
-creds_json = json.loads(os.environ.get("GOOGLE_CREDS_JSON"))
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_json, scope)
-client = gspread.authorize(creds)
+client = None
+client_lock = threading.Lock()
+BOT_STARTED = time_module.time()
 
-sheet_murid = client.open_by_key(SHEET_ID).worksheet("Senarai Murid")
-sheet_kehadiran = client.open_by_key(SHEET_ID).worksheet("Kehadiran")
+
+def get_client():
+    """Satu akaun servis dikongsi oleh semua sekolah."""
+
+    global client
+    with client_lock:
+        if client is None:
+            creds_json = json.loads(os.environ["GOOGLE_CREDS_JSON"])
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_json, scope)
+            client = gspread.authorize(creds)
+            # Lalai gspread tiada had masa: sambungan tergantung akan menahan thread selama-lamanya
+            client.set_timeout(SHEETS_TIMEOUT)
+    return client
+
+
+def init_sheets(t=None):
+    """Buka spreadsheet sekolah sekali sahaja; kedua-dua worksheet guna handle yang sama."""
+
+    t = t or tenant()
+    if t.spreadsheet is not None:
+        return
+
+    t0 = time_module.monotonic()
+    gc = get_client()
+    t.startup_state["masa"]["auth"] = round(time_module.monotonic() - t0, 3)
+
+    # Semua handle dibina dahulu; t.spreadsheet ditetapkan terakhir supaya kegagalan separuh jalan dicuba semula
+    t0 = time_module.monotonic()
+    spreadsheet = gc.open_by_key(t.sheet_id)
+    worksheets = {ws.title: ws for ws in spreadsheet.worksheets()}
+    sheet_murid = worksheets["Senarai Murid"]
+    sheet_kehadiran = worksheets["Kehadiran"]
+
+    t.sheet_murid = sheet_murid
+    t.sheet_kehadiran = sheet_kehadiran
+    t.spreadsheet = spreadsheet
+    t.startup_state["masa"]["buka_sheet"] = round(time_module.monotonic() - t0, 3)
 
 
 # ======================
@@ -73,6 +193,164 @@ ALL_CLASSES = [
 ]
 
 
+# ======================
+# 🏫 SEKOLAH (TENANT)
+# ======================
+# Setiap update / tugasan berjalan dalam konteks satu sekolah (contextvar); semua
+# sheet, cache, jurnal & tetapan dibaca melalui tenant().
+_current_tenant = contextvars.ContextVar("tenant", default=None)
+TENANTS = {}
+
+
+class Tenant:
+    """Satu sekolah: sheet, senarai kelas, group, jadual dan cache yang diasingkan."""
+
+    def __init__(self, tid, nama, sheet_id, group_id=None, kelas=None, admin_ids=(), guru_ids=(),
+                 jadual=None, index=0, single=True):
+        self.id = tid
+        self.nama = nama
+        self.sheet_id = sheet_id
+        self.group_id = int(group_id) if group_id not in (None, "") else None
+        self.classes = list(kelas or ALL_CLASSES)
+        self.admin_ids = {int(x) for x in admin_ids}
+        self.guru_ids = {int(x) for x in guru_ids}
+        self.index = index
+
+        # Fail tempatan: laluan asal untuk satu sekolah, berakhiran id untuk berbilang sekolah
+        self.journal_path = JOURNAL_PATH if single else _tenant_path(JOURNAL_PATH, tid)
+        self.snapshot_path = DASHBOARD_SNAPSHOT_PATH if single else _tenant_path(DASHBOARD_SNAPSHOT_PATH, tid)
+        self.archive_dir = ARCHIVE_DIR if single else os.path.join(ARCHIVE_DIR, tid)
+        self.jobs_file = jadual or (JOBS_FILE if single else _tenant_path(JOBS_FILE, tid))
+
+        self.spreadsheet = None
+        self.sheet_murid = None
+        self.sheet_kehadiran = None
+        self.sheets_ready = asyncio.Event()
+        self.startup_state = {"masa": {}, "ralat": None, "cache_sedia": False}
+
+        self.data_version = {"n": 0}
+        self.modified_probe = {"value": None, "checked_at": None, "panggilan": 0}
+        self.own_writes = OrderedDict()  # modifiedTime sebelum → selepas setiap tulisan bot sendiri
+        self.murid_cache = {"records": None, "fetched_at": 0.0, "modified": None, "hash": None, "muat_turun": 0}
+        self.roster_index = {"source": None, "index": None}
+        self.attendance_index = {"source": None, "index": None}
+        self.kehadiran_mirror = SheetMirror(lambda: self.sheet_kehadiran)
+        self.cube = AttendanceCube()
+        self.kehadiran_mirror.on_change = self.cube.on_mirror_change
+        self.response_cache = ResponseCache()
+        self.journal = AttendanceJournal(self.journal_path)
+        self.stats = {"update": 0, "simpanan": 0, "tugasan": 0}
+
+    @property
+    def stagger(self):
+        """Ofset (saat) tugasan berjadual supaya sekolah tidak serentak menggunakan kuota Sheets.
+
+        Langkah TENANT_STAGGER dikecilkan apabila sekolah banyak supaya ofset terakhir kekal dalam
+        TENANT_STAGGER_WINDOW (peringatan 10:00 sekolah ke-30 tidak beralih ke 11:00).
+        """
+        step = min(TENANT_STAGGER, TENANT_STAGGER_WINDOW / max(len(TENANTS), 1))
+        return int(self.index * step)
+
+    def job_name(self, name):
+        return name if len(TENANTS) <= 1 else f"{self.id}:{name}"
+
+
+def _tenant_path(path, tid):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{tid}{ext}"
+
+
+def load_tenants():
+    if not TENANTS_JSON:
+        return {"utama": Tenant("utama", SCHOOL_NAME, SHEET_ID, GROUP_ID)}
+
+    with open(TENANTS_JSON, encoding="utf-8") as f:
+        specs = json.load(f)
+
+    single = len(specs) == 1
+    tenants = {}
+    for i, spec in enumerate(specs):
+        t = Tenant(
+            str(spec["id"]), spec.get("nama") or str(spec["id"]), spec["sheet_id"],
+            group_id=spec.get("group_id"), kelas=spec.get("kelas"),
+            admin_ids=spec.get("admin_ids", ()), guru_ids=spec.get("guru_ids", ()),
+            jadual=spec.get("jadual"), index=i, single=single
+        )
+        tenants[t.id] = t
+    return tenants
+
+
+def all_tenants():
+    if not TENANTS:
+        TENANTS.update(load_tenants())
+    return list(TENANTS.values())
+
+
+def tenant():
+    t = _current_tenant.get()
+    if t is not None:
+        return t
+    tenants = all_tenants()
+    if len(tenants) == 1:
+        return tenants[0]
+    raise RuntimeError("Tiada sekolah aktif dalam konteks ini")
+
+
+def set_tenant(t):
+    return _current_tenant.set(t)
+
+
+def enter_job_tenant(context):
+    """Tetapkan sekolah semasa bagi tugasan berjadual dari context.job.data["sekolah"]."""
+
+    data = context.job.data if context.job else None
+    tid = data.get("sekolah") if isinstance(data, dict) else None
+    if tid is not None:
+        set_tenant(TENANTS[tid])
+    return tenant()
+
+
+# Pilihan sekolah oleh guru (bagi guru yang tidak disenaraikan dalam guru_ids)
+_tenant_users = {"map": None}
+
+
+def _load_tenant_users():
+    if _tenant_users["map"] is None:
+        try:
+            with open(TENANT_USERS_PATH, encoding="utf-8") as f:
+                _tenant_users["map"] = {int(k): v for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            _tenant_users["map"] = {}
+    return _tenant_users["map"]
+
+
+def remember_tenant(user_id, t):
+    users = _load_tenant_users()
+    users[user_id] = t.id
+    tmp_path = TENANT_USERS_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({str(k): v for k, v in users.items()}, f)
+    os.replace(tmp_path, TENANT_USERS_PATH)
+
+
+def resolve_tenant(chat_id=None, user_id=None):
+    """Sekolah bagi update: group sekolah → senarai guru/pentadbir → pilihan tersimpan → satu-satunya sekolah."""
+
+    tenants = all_tenants()
+    if len(tenants) == 1:
+        return tenants[0]
+
+    for t in tenants:
+        if chat_id is not None and chat_id == t.group_id:
+            return t
+    for t in tenants:
+        if user_id in t.guru_ids or user_id in t.admin_ids:
+            return t
+
+    tid = _load_tenant_users().get(user_id)
+    return TENANTS.get(tid)
+
+
 # ======================
 # UTILS
 # ======================
@@ -95,994 +373,3940 @@ def clean_student_name(full_name):
     return " ".join(cleaned_words)
 
 
-def get_students_by_class(kelas):
-    records = sheet_murid.get_all_records()
-    students = []
-    for r in records:
-        if r["Kelas"] == kelas:
-            name = clean_student_name(r["Nama Murid"])
-            if r["Catatan"]:
-                name += f" ({r['Catatan']})"
-            students.append(name)
-    return students
+def parse_absent(value):
+    return value.split(", ") if value else []
 
 
-def format_attendance(kelas, tarikh, hari, total, absent):
-    hadir = total - len(absent)
+def parse_tarikh(value):
+    try:
+        return datetime.datetime.strptime(str(value), "%d/%m/%Y").date()
+    except (ValueError, TypeError):
+        return None
 
-    msg = (
-        f"🏫 {kelas}\n"
-        f"📅 {hari}\n"
-        f"🗓 {tarikh}\n\n"
-        f"📊 Kehadiran\n"
-        f"{hadir}/{total}\n"
-    )
 
-    if absent:
-        msg += f"\n❌ Tidak Hadir ({len(absent)} murid)\n"
-        for i, n in enumerate(absent, 1):
-            msg += f"{i}. {n}\n"
-    else:
-        msg += "\n🎉 Semua murid hadir.\n"
+def bump_data_version():
+    """Versi data sekolah semasa: naik setiap kali rekod ditulis atau salinan sheet berubah (kunci cache respons)."""
+    tenant().data_version["n"] += 1
 
-    return msg
 
+def values_to_records(values):
+    """Setara get_all_records(): baris pertama sebagai kepala, nombor ditukar ke int/float."""
 
-def find_existing_row(kelas, tarikh):
-    records = sheet_kehadiran.get_all_records()
-    for idx, r in enumerate(records, start=2):
-        if r["Kelas"] == kelas and r["Tarikh"] == tarikh:
-            return idx
-    return None
+    if not values:
+        return []
+    header = values[0]
+    return [dict(zip(header, gspread.utils.numericise_all(_pad_row(r, len(header))))) for r in values[1:]]
+
+
+def _pad_row(row, width):
+    row = [str(v) for v in row[:width]]
+    return row + [""] * (width - len(row))
 
 
 # ======================
-# 🔔 SEMAK SEMUA KELAS & HANTAR KE GROUP
+# 🔎 PENGESANAN PERUBAHAN SHEET (DELTA)
 # ======================
-async def check_all_classes_completed(context):
+def sheet_modified_time(force=False):
+    """modifiedTime spreadsheet dari Drive (beberapa bait); None jika tidak dapat dibaca."""
 
-    today = get_today_malaysia()
-    tarikh = today.strftime("%d/%m/%Y")
-
-    records = sheet_kehadiran.get_all_records()
+    t = tenant()
+    probe = t.modified_probe
+    now = time_module.monotonic()
+    if not force and probe["checked_at"] is not None and now - probe["checked_at"] < CHANGE_PROBE_INTERVAL:
+        return probe["value"]
 
-    recorded = set()
-    for r in records:
-        if r["Tarikh"] == tarikh:
-            recorded.add(r["Kelas"].strip().lower())
+    try:
+        value = t.spreadsheet.get_lastUpdateTime()
+    except Exception:
+        logger.debug("modifiedTime tidak dapat dibaca", exc_info=True)
+        value = None
+
+    probe.update(value=value, checked_at=now)
+    probe["panggilan"] += 1
+    return value
+
+
+def own_write(write):
+    """Jalankan tulisan bot `write()` dan rekod peralihan modifiedTime yang disebabkannya."""
+
+    before = sheet_modified_time(force=True)
+    result = write()
+    after = sheet_modified_time(force=True)
+    if before is not None and after is not None and before != after:
+        writes = tenant().own_writes
+        writes[before] = after
+        while len(writes) > OWN_WRITES_KEPT:
+            writes.popitem(last=False)
+    return result
+
+
+def explained_by_own_writes(old, new):
+    """True jika modifiedTime `old` → `new` hanya hasil rantaian tulisan bot sendiri (tiada suntingan lain di antaranya)."""
+
+    writes = tenant().own_writes
+    seen = set()
+    while old is not None and old != new and old not in seen:
+        seen.add(old)
+        old = writes.get(old)
+    return old is not None and old == new
+
+
+class SheetMirror:
+    """Salinan worksheet ikut susunan baris; disegar dengan modifiedTime + bacaan ekor (baris baharu sahaja)."""
+
+    def __init__(self, get_worksheet, overlap=KEHADIRAN_TAIL_OVERLAP, on_change=None):
+        self.get_worksheet = get_worksheet
+        self.overlap = overlap
+        self.on_change = on_change  # dipanggil dalam self.lock: None = salinan diganti penuh, selain itu rekod berubah
+        self.header = None
+        self.rows = None
+        self.records = None
+        self.modified = None
+        self.fetched_at = 0.0
+        self.full_at = 0.0
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.stats = {"penuh": 0, "delta": 0, "baris_delta": 0, "tiada_perubahan": 0, "batal": 0}
+
+    def refresh(self, max_age=0, full=False):
+        # Bacaan Sheets berlaku di luar self.lock; kunci hanya dipegang semasa menukar salinan,
+        # jadi apply_write() & pembaca salinan tidak menunggu rangkaian. fetch_lock: satu bacaan pada satu masa.
+        with self.fetch_lock:
+            now = time_module.monotonic()
+            if full or self.rows is None or now - self.full_at > KEHADIRAN_FULL_SYNC:
+                done = self._full_fetch(now)
+            elif now - self.fetched_at > max_age:
+                modified = sheet_modified_time()
+                if modified is not None and modified == self.modified:
+                    self.stats["tiada_perubahan"] += 1
+                    done = True
+                elif modified is None or explained_by_own_writes(self.modified, modified):
+                    # Hanya tulisan bot sendiri sejak bacaan terakhir (atau Drive tidak dapat
+                    # ditanya; KEHADIRAN_FULL_SYNC mengehadkan tempoh): semak ekor sahaja
+                    done = self._delta_fetch(now, modified)
+                else:
+                    # Perubahan luar (suntingan manual, import CLI): baris mana-mana boleh berubah
+                    done = self._full_fetch(now)
+            else:
+                done = False
+            if done:
+                self.fetched_at = now
+
+    def invalidate(self):
+        self.full_at = 0.0
+
+    def _set(self, header, rows, records, changed=None):
+        self.header, self.rows, self.records = header, rows, records
+        if self.on_change:
+            self.on_change(changed)
+        bump_data_version()
+
+    def _full_fetch(self, now, attempts=3):
+        for _ in range(attempts):
+            base = self.rows
+            modified = sheet_modified_time()
+            values = self.get_worksheet().get_all_values()
+            header = values[0] if values else []
+            rows = [_pad_row(r, len(header)) for r in values[1:]]
+
+            with self.lock:
+                if self.rows is not base:
+                    # Bot menulis semasa bacaan; hasil mungkin tidak mengandungi tulisan itu: baca semula
+                    self.stats["batal"] += 1
+                    continue
+                if header != self.header or rows != self.rows:
+                    self._set(header, rows, values_to_records([header] + rows))
+                self.modified = modified
+                self.full_at = now
+                self.stats["penuh"] += 1
+                return True
+        return False
+
+    def _delta_fetch(self, now, modified):
+        base, width = self.rows, len(self.header)
+        start = max(0, len(base) - self.overlap)
+        last_col = gspread.utils.rowcol_to_a1(1, max(width, 1))[:-1]
+        values = self.get_worksheet().get_values(f"A{start + 2}:{last_col}")
+        if values == [[]]:
+            values = []  # tiada baris dalam julat
+        fetched = [_pad_row(r, width) for r in values]
+
+        with self.lock:
+            if self.rows is not base:
+                self.stats["batal"] += 1
+                return False  # bot menulis semasa bacaan: cuba lagi pada segar semula seterusnya
+
+            overlap = len(base) - start
+            new_rows = fetched[overlap:]
+            if fetched[:overlap] != base[start:]:
+                # Baris disisip / dipadam / disunting berhampiran ekor: segerak penuh
+                need_full = True
+            else:
+                if new_rows:
+                    new_records = values_to_records([self.header] + new_rows)
+                    self._set(self.header, base + new_rows, self.records + new_records, new_records)
+                    self.stats["baris_delta"] += len(new_rows)
+                self.stats["delta"] += 1
+                need_full = False
+
+            if not need_full:
+                self.modified = modified
+                return True
+
+        return self._full_fetch(now)
+
+    def apply_write(self, values, row=None):
+        """Kemas kini salinan selepas bot sendiri menulis melalui own_write() (row=None → ditambah di hujung)."""
+
+        with self.lock:
+            if self.rows is None:
+                return
+            padded = _pad_row(values, len(self.header))
+            record = values_to_records([self.header, padded])[0]
+            rows, records = list(self.rows), list(self.records)
+            if row is None:
+                rows.append(padded)
+                records.append(record)
+            else:
+                rows[row - 2] = padded
+                records[row - 2] = record
+            self._set(self.header, rows, records, [record])
+
+    def find_row(self, kelas, tarikh):
+        # Baris terakhir yang sepadan: sama dengan pembaca (AttendanceIndex) & repair_duplicates
+        records = self.records or []
+        for idx in range(len(records) - 1, -1, -1):
+            r = records[idx]
+            if r["Kelas"] == kelas and r["Tarikh"] == tarikh:
+                return idx + 2
+        return None
+
+    def metrics(self):
+        return dict(self.stats, baris=len(self.rows or []), modified=self.modified)
+
+
+def get_murid_records(max_age=ROSTER_CACHE_TTL):
+    """Senarai Murid; dimuat turun semula hanya jika fail berubah, dan dibina semula hanya jika kandungan berubah."""
+
+    t = tenant()
+    cache = t.murid_cache
+    now = time_module.monotonic()
+    if cache["records"] is None or now - cache["fetched_at"] > max_age:
+        try:
+            modified = sheet_modified_time()
+            if cache["records"] is None or modified is None or not (
+                    modified == cache["modified"] or explained_by_own_writes(cache["modified"], modified)):
+                values = t.sheet_murid.get_all_values()
+                cache["muat_turun"] += 1
+                if missing_student_ids(values):
+                    # Murid ditambah semasa bot berjalan: beri ID sekarang, bukan hanya semasa permulaan
+                    try:
+                        logger.info("%d murid baharu diberi ID", assign_student_ids(values))
+                    except Exception:
+                        logger.warning("ID murid baharu tidak dapat ditulis; guna ID sementara", exc_info=True)
+                        modified = None  # cuba tulis semula pada muat turun seterusnya
+                digest = hashlib.sha1(json.dumps(values, ensure_ascii=False).encode()).hexdigest()
+                if digest != cache["hash"]:
+                    cache["records"] = values_to_records(values)
+                    cache["hash"] = digest
+                    bump_data_version()
+            # Tulisan bot sendiri (cth. simpan Kehadiran) juga mengubah modifiedTime fail: tidak dimuat turun semula
+            cache["modified"] = modified
+            cache["fetched_at"] = now
+        except Exception:
+            if cache["records"] is None:
+                raise
+            logger.warning("Senarai Murid tidak dapat dicapai; guna salinan terakhir", exc_info=True)
+    return cache["records"]
 
-    belum = [k for k in ALL_CLASSES if k.strip().lower() not in recorded]
 
-    if not belum:
+def get_kehadiran_records(max_age=0):
+    """Rekod Kehadiran (sheet + jurnal belum disegerak); guna salinan terakhir jika Sheets tidak dapat dicapai."""
 
-        msg = (
-            "✅ Kehadiran Lengkap Hari Ini\n\n"
-            f"📅 Tarikh: {tarikh}\n\n"
-            "Semua kelas telah berjaya merekod kehadiran.\n"
-            "Terima kasih atas kerjasama semua guru. 🙏\n\n"
-            "📊 Sistem Tracker Kehadiran SK Labu Besar"
-        )
+    t = tenant()
+    try:
+        t.kehadiran_mirror.refresh(max_age)
+    except Exception:
+        if t.kehadiran_mirror.records is None:
+            raise
+        logger.warning("Sheet Kehadiran tidak dapat dicapai; guna salinan terakhir", exc_info=True)
+    return t.journal.merge(t.kehadiran_mirror.records)
 
-        try:
-            await context.bot.send_message(chat_id=GROUP_ID, text=msg)
-        except Exception:
-            pass
 
+def sync_metrics():
+    t = tenant()
+    return {
+        "kehadiran": t.kehadiran_mirror.metrics(),
+        "murid_muat_turun": t.murid_cache["muat_turun"],
+        "semakan_modified": t.modified_probe["panggilan"]
+    }
 
-# ======================
-# START / MENU UTAMA
-# ======================
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
-    inline_keyboard = [
-    [InlineKeyboardButton("📋 Rekod Kehadiran", callback_data="rekod")],
-    [InlineKeyboardButton("🔍 Semak Kehadiran", callback_data="semak")],
-    [InlineKeyboardButton("🍱 Semak RMT Hari Ini", callback_data="semak_rmt_today")],
-    [InlineKeyboardButton("📊 Statistik Kehadiran", callback_data="smart_statistik")]
-    ]
+class RosterIndex:
+    """Indeks senarai murid: ID stabil → murid, kelas → senarai ID, nama → ID."""
 
-    reply_keyboard = ReplyKeyboardMarkup(
-        [
-            [KeyboardButton("🏠 Menu Utama")],
-            [KeyboardButton("📊 Dashboard")]
-        ],
-        resize_keyboard=True
-    )
-    quote = get_random_quote()
+    def __init__(self, murid_records):
+        self.students = {}
+        self.by_class = {}
+        self.by_name = {}
+        self.provisional = set()
 
-    text = (
-        "🏫 Tracker Kehadiran Murid SK Labu Besar\n\n"
-        f"💬 {quote}\n\n"
-        "Pilih menu:"
-    )
+        ids = []
+        for r in murid_records:
+            try:
+                ids.append(int(r.get("ID")))
+            except (ValueError, TypeError):
+                ids.append(None)
+
+        # Baris tanpa ID (penulisan ID gagal): ID sementara ikut peraturan assign_student_ids
+        # (maks + 1 ikut susunan baris), supaya murid tetap dalam senarai & Jumlah tidak berkurang
+        next_id = max([i for i in ids if i is not None], default=0) + 1
+
+        for r, sid in zip(murid_records, ids):
+            if sid is None:
+                if not any(str(v).strip() for v in r.values()):
+                    continue
+                sid = next_id
+                next_id += 1
+                self.provisional.add(sid)
+
+            nama = str(r["Nama Murid"])
+            catatan = str(r.get("Catatan") or "")
+            display = clean_student_name(nama)
+            if catatan:
+                display += f" ({catatan})"
+
+            self.students[sid] = {
+                "id": sid,
+                "kelas": r["Kelas"],
+                "nama": nama,
+                "display": display,
+                "nama_pendek": clean_student_name(nama.replace("(RMT)", "").strip()),
+                "rmt": "(RMT)" in nama.upper() or "RMT" in catatan.upper()
+            }
+            self.by_class.setdefault(r["Kelas"], []).append(sid)
 
-    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard))
-    await update.message.reply_text(
-        "🏠 Tekan butang di bawah untuk kembali ke Menu Utama",
-        reply_markup=reply_keyboard
-    )
+            names = self.by_name.setdefault(r["Kelas"], {})
+            for alias in (display, clean_student_name(nama), nama):
+                names.setdefault(alias.strip().upper(), sid)
 
+    def display(self, sid):
+        student = self.students.get(sid)
+        return student["display"] if student else f"#{sid}"
 
-# ======================
-# BUTTON HANDLER
-# ======================
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    def lookup(self, kelas, name):
+        return self.by_name.get(kelas, {}).get(str(name).strip().upper())
 
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    data = query.data
 
-    if data == "semak_rmt_today":
+def get_roster():
+    records = get_murid_records()
+    cache = tenant().roster_index
+    if cache["source"] is not records:
+        cache["index"] = RosterIndex(records)
+        cache["source"] = records
+    return cache["index"]
 
-        today = get_today_malaysia()
-        tarikh = today.strftime("%d/%m/%Y")
 
-        murid_records = sheet_murid.get_all_records()
+def get_roster_fresh():
+    get_murid_records(max_age=0)
+    return get_roster()
 
-        # ======================
-        # BINA DATA RMT → KELAS
-        # ======================
-        rmt_by_class = {}
-        all_rmt_students = set()
 
-        for r in murid_records:
-            nama = r["Nama Murid"]
-            kelas = r["Kelas"]
-            catatan = str(r.get("Catatan", "")).upper()
-
-            if "(RMT)" in nama.upper() or "RMT" in catatan:
-                nama_bersih = clean_student_name(nama.replace("(RMT)", "").strip())
-                all_rmt_students.add(nama_bersih)
-
-                if kelas not in rmt_by_class:
-                    rmt_by_class[kelas] = []
-
-                rmt_by_class[kelas].append(nama_bersih)
-
-        # ======================
-        # SEMAK KEHADIRAN
-        # ======================
-        hadir_records = sheet_kehadiran.get_all_records()
-        tidak_hadir_by_class = {}
-
-        for r in hadir_records:
-            if r["Tarikh"] == tarikh:
-                kelas = r["Kelas"]
-                absent_list = r["Tidak Hadir"].split(", ") if r["Tidak Hadir"] else []
-
-                for name in absent_list:
-                    nama_bersih = name.replace("(RMT)", "").strip()
-                    if nama_bersih in all_rmt_students:
-                        tidak_hadir_by_class.setdefault(kelas, []).append(nama_bersih)
-
-        # ======================
-        # KIRAAN
-        # ======================
-        total_rmt = len(all_rmt_students)
-        total_tidak_hadir = sum(len(v) for v in tidak_hadir_by_class.values())
-        hadir_rmt = total_rmt - total_tidak_hadir
-
-        # ======================
-        # PAPARAN
-        # ======================
-        msg = (
-            "🍱 Laporan Kehadiran RMT Hari Ini\n\n"
-            f"📅 {tarikh}\n"
-            f"📊 Hadir: {hadir_rmt} / {total_rmt}\n"
-        )
+class AttendanceIndex:
+    """Indeks rekod Kehadiran: kelas → {tarikh → rekod} untuk carian & kalendar tanpa imbas penuh."""
 
-        if tidak_hadir_by_class:
-            msg += f"\n❌ Tidak Hadir ({total_tidak_hadir} murid)\n"
+    def __init__(self, records):
+        self.by_class = {}
+        for r in records:
+            d = parse_tarikh(r["Tarikh"])
+            if d is not None:
+                self.by_class.setdefault(r["Kelas"], {})[d] = r
 
-            for kelas in sorted(tidak_hadir_by_class):
-                murid = tidak_hadir_by_class[kelas]
-                msg += f"\n🏫 {kelas}\n"
-                for i, nama in enumerate(murid, 1):
-                    msg += f"{i}. {nama}\n"
-        else:
-            msg += "\n🎉 Semua murid RMT hadir hari ini.\n"
+    def get(self, kelas, d):
+        return self.by_class.get(kelas, {}).get(d)
 
-        await query.edit_message_text(msg)
-        return
+    def dates(self, kelas):
+        return self.by_class.get(kelas, {}).keys()
 
-    if data == "smart_statistik":
-        await show_smart_dashboard(query)
-        return
 
+def get_attendance_index(max_age=KEHADIRAN_CACHE_TTL):
+    records = get_kehadiran_records(max_age)
+    cache = tenant().attendance_index
+    if cache["source"] is not records:
+        cache["index"] = AttendanceIndex(records)
+        cache["source"] = records
+    return cache["index"]
 
-    # ---------- REKOD ----------
-    if data == "rekod":
-        records = sheet_murid.get_all_records()
-        kelas_list = sorted(set(r["Kelas"] for r in records))
-        
-        keyboard = []
-        row = []
 
-        for k in kelas_list:
-            row.append(InlineKeyboardButton(k, callback_data=f"kelas|{k}"))
-            if len(row) == 3:
-                keyboard.append(row)
-                row = []
+# ======================
+# 🧊 KIUB KEHADIRAN (ROLLUP TAHUN & SEKOLAH)
+# ======================
+# Sel pra-agregat [hadir, jumlah, bil. rekod] bagi setiap (butiran, tempoh, aras, ahli):
+#   butiran: hari | minggu (bermula Ahad) | bulan
+#   aras   : sekolah ("*") | tahun ("1".."6", "PRA") | kelas
+# Setiap simpanan / baris delta mengemas kini 9 sel; bina semula hanya selepas bacaan penuh sheet.
+CUBE_GRAINS = ("hari", "minggu", "bulan")
+CUBE_SCHOOL = "*"
 
-        if row:
-            keyboard.append(row)
 
-        await query.edit_message_text("Pilih kelas:", reply_markup=InlineKeyboardMarkup(keyboard))
-        return
+def year_level(kelas):
+    """Aras tahun dari awalan nama kelas: "1".."6", "PRA", atau "LAIN"."""
 
-    if data.startswith("kelas|"):
-        kelas = data.split("|")[1]
-        students = get_students_by_class(kelas)
+    parts = str(kelas).split()
+    prefix = parts[0].upper() if parts else ""
+    return prefix if prefix.isdigit() or prefix == "PRA" else "LAIN"
 
-        today = get_today_malaysia()
-        tarikh = today.strftime("%d/%m/%Y")
-        hari = today.strftime("%A")
 
-        user_state[user_id] = {
-            "kelas": kelas,
-            "tarikh": tarikh,
-            "hari": hari,
-            "students": students,
-            "absent": []
-        }
+def year_label(level):
+    if level == "PRA":
+        return "Prasekolah"
+    if level == "LAIN":
+        return "Lain-lain"
+    return f"Tahun {level}"
 
-        await show_student_buttons(query, user_id)
-        return
 
-    # ---------- PILIH MURID ----------
-    if data.startswith("murid|"):
-        name = data.split("|")[1]
-        state = user_state[user_id]
+def year_levels(classes):
+    """Aras tahun ikut susunan senarai kelas sekolah."""
 
-        if name in state["absent"]:
-            state["absent"].remove(name)
-        else:
-            state["absent"].append(name)
+    return list(dict.fromkeys(year_level(k) for k in classes))
 
-        await show_student_buttons(query, user_id)
-        return
 
-    # ---------- RESET ----------
-    if data == "reset":
-        user_state[user_id]["absent"] = []
-        await show_student_buttons(query, user_id)
-        return
+def period_start(grain, d):
+    if grain == "minggu":
+        return d - datetime.timedelta(days=(d.weekday() + 1) % 7)
+    if grain == "bulan":
+        return d.replace(day=1)
+    return d
 
-    # ---------- SIMPAN / SEMUA HADIR ----------
-    if data in ["simpan", "semua_hadir"]:
 
-        state = user_state[user_id]
-        kelas = state["kelas"]
-        tarikh = state["tarikh"]
-        hari = state["hari"]
-        total = len(state["students"])
+class AttendanceCube:
+    """Rollup kehadiran ikut hari/minggu/bulan × sekolah/tahun/kelas; setiap pertanyaan satu carian dict."""
 
-        absent = [] if data == "semua_hadir" else state["absent"]
-        hadir = total - len(absent)
+    def __init__(self):
+        self.lock = threading.RLock()  # kunci sendiri (tiada rangkaian): simpanan tidak menunggu Sheets
+        self.cells = {}
+        self.contrib = {}  # (kelas, tarikh) → (hadir, jumlah) yang telah dikira
+        self.stale = True
+        self.stats = {"bina_semula": 0, "kemas_kini": 0}
 
-        row = find_existing_row(kelas, tarikh)
+    def _add(self, kelas, d, hadir, total, sign):
+        members = (("sekolah", CUBE_SCHOOL), ("tahun", year_level(kelas)), ("kelas", kelas))
+        for grain in CUBE_GRAINS:
+            period = period_start(grain, d)
+            for level, member in members:
+                cell = self.cells.setdefault((grain, period, level, member), [0, 0, 0])
+                cell[0] += sign * hadir
+                cell[1] += sign * total
+                cell[2] += sign
 
-        if row:
-            user_state[user_id]["pending_overwrite"] = {
-                "row": row,
-                "kelas": kelas,
-                "tarikh": tarikh,
-                "hari": hari,
-                "hadir": hadir,
-                "total": total,
-                "absent": absent
-            }
+    def _put(self, kelas, d, hadir, total):
+        """Ganti sumbangan (kelas, tarikh): tolak nilai lama, tambah nilai baharu (total 0 = buang)."""
 
-            keyboard = [[
-                InlineKeyboardButton("✅ Ya, Overwrite", callback_data="confirm_overwrite"),
-                InlineKeyboardButton("❌ Batal", callback_data="cancel_overwrite")
-            ]]
+        old = self.contrib.pop((kelas, d), None)
+        if old is not None:
+            self._add(kelas, d, old[0], old[1], -1)
+        if total > 0:
+            self._add(kelas, d, hadir, total, 1)
+            self.contrib[(kelas, d)] = (hadir, total)
 
-            await query.edit_message_text(
-                f"⚠️ Rekod kehadiran untuk\n\n🏫 {kelas}\n🗓 {tarikh}\n\nsudah wujud.\n\nAdakah anda mahu overwrite?",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+    def _apply(self, r):
+        d = parse_tarikh(r.get("Tarikh"))
+        if d is None:
+            return
+        try:
+            total = int(r["Jumlah"])
+        except (ValueError, TypeError, KeyError):
+            total = 0
+        self._put(r["Kelas"], d, total - absent_count(r) if total > 0 else 0, total)
+
+    def apply(self, r):
+        with self.lock:
+            self._apply(r)
+            self.stats["kemas_kini"] += 1
+
+    def rebuild(self, records):
+        with self.lock:
+            self.cells, self.contrib = {}, {}
+            # Hari yang sudah diarkib dari ringkasan arkib; rekod sheet utama menang
+            for day, per_kelas in load_archive_summary().items():
+                for kelas, (hadir, total) in per_kelas.items():
+                    self._put(kelas, datetime.date.fromisoformat(day), hadir, total)
+            for r in records:
+                self._apply(r)
+            self.stale = False
+            self.stats["bina_semula"] += 1
+
+    def on_mirror_change(self, changed):
+        if changed is None:
+            with self.lock:
+                self.stale = True
             return
 
-        sheet_kehadiran.append_row([tarikh, hari, kelas, hadir, total, ", ".join(absent)])
-        msg = format_attendance(kelas, tarikh, hari, total, absent)
-        await query.edit_message_text("✅ Kehadiran berjaya disimpan!\n\n" + msg)
+        journal = tenant().journal
+        for r in changed:
+            # Entri jurnal belum disegerak menang (seperti journal.merge) dan sudah dikira semasa simpanan
+            if not journal.has(r["Kelas"], r["Tarikh"]):
+                self.apply(r)
 
-        # 🔔 PANGGIL SEMAK GROUP
-        await check_all_classes_completed(context)
+    def stat(self, grain, d, level="sekolah", member=CUBE_SCHOOL):
+        """(hadir, jumlah, bil. rekod) bagi tempoh `grain` yang mengandungi tarikh `d`."""
 
-        user_state.pop(user_id, None)
-        return
+        return tuple(self.cells.get((grain, period_start(grain, d), level, member), (0, 0, 0)))
 
-    # ---------- CONFIRM OVERWRITE ----------
-    if data == "confirm_overwrite":
+    def range_stat(self, start, end, level="sekolah", member=CUBE_SCHOOL):
+        """Jumlah bagi julat tarikh (inklusif): bulan penuh dari sel bulan, hujung separa dari sel hari."""
 
-        info = user_state[user_id]["pending_overwrite"]
-        sheet_kehadiran.delete_rows(info["row"])
-        sheet_kehadiran.append_row([
-            info["tarikh"], info["hari"], info["kelas"],
-            info["hadir"], info["total"], ", ".join(info["absent"])
-        ])
+        hadir = total = count = 0
+        d = start
+        while d <= end:
+            next_month = (d.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+            if d.day == 1 and next_month - datetime.timedelta(days=1) <= end:
+                cell = self.stat("bulan", d, level, member)
+                d = next_month
+            else:
+                cell = self.stat("hari", d, level, member)
+                d += datetime.timedelta(days=1)
+            hadir += cell[0]
+            total += cell[1]
+            count += cell[2]
+        return hadir, total, count
 
-        msg = format_attendance(info["kelas"], info["tarikh"], info["hari"], info["total"], info["absent"])
-        await query.edit_message_text("🔄 Rekod berjaya dioverwrite!\n\n" + msg)
+    def metrics(self):
+        return dict(self.stats, sel=len(self.cells), rekod=len(self.contrib), perlu_bina=self.stale)
 
-        # 🔔 PANGGIL SEMAK GROUP
-        await check_all_classes_completed(context)
 
-        user_state.pop(user_id, None)
-        return
+def get_cube(max_age=KEHADIRAN_CACHE_TTL):
+    t = tenant()
+    get_kehadiran_records(max_age)
+    with t.cube.lock:
+        if t.cube.stale:
+            # Salinan semasa tanpa rangkaian; perubahan yang tiba selepas ini diguna semula secara idempotent
+            t.cube.rebuild(t.journal.merge(t.kehadiran_mirror.records))
+    return t.cube
 
-    # ---------- BATAL OVERWRITE ----------
-    if data == "cancel_overwrite":
-        await query.edit_message_text("❌ Overwrite dibatalkan. Rekod asal dikekalkan.")
-        user_state.pop(user_id, None)
-        return
 
-    # ---------- SEMAK ----------
-    if data == "semak":
-        records = sheet_murid.get_all_records()
-        kelas_list = sorted(set(r["Kelas"] for r in records))
+def encode_absent_ids(ids):
+    return ";".join(str(i) for i in ids)
 
-        keyboard = []
-        row = []
 
-        for k in kelas_list:
-            row.append(InlineKeyboardButton(k, callback_data=f"semak_kelas|{k}"))
-            if len(row) == 3:
-                keyboard.append(row)
-                row = []
+def absent_ids(r):
+    """Senarai ID murid tidak hadir, atau None bagi rekod lama yang hanya menyimpan nama."""
 
-        if row:
-            keyboard.append(row)
+    value = r.get("ID Tidak Hadir")
+    if value in (None, ""):
+        return None
+    return [int(x) for x in str(value).split(";") if x.strip()]
 
-        keyboard.append([
-            InlineKeyboardButton("📄 Export PDF Mingguan", callback_data="export_pdf_weekly")
-        ])
 
+def absent_count(r):
+    ids = absent_ids(r)
+    return len(ids) if ids is not None else len(parse_absent(r["Tidak Hadir"]))
 
-        await query.edit_message_text("Pilih kelas untuk semak:", reply_markup=InlineKeyboardMarkup(keyboard))
-        return
 
-    # ---------- EXPORT PDF ----------
-    if data == "export_pdf_weekly":
-        await export_pdf_weekly(query)
-        return
+def absent_names(r, roster=None):
+    """Nama murid tidak hadir; murid yang sudah keluar dari senarai guna nama yang tersimpan pada baris."""
 
-    # ---------- PILIH KELAS SEMAK ----------
-    if data.startswith("semak_kelas|"):
-        kelas = data.split("|")[1]
-        user_state[user_id] = {"semak_kelas": kelas}
+    stored = parse_absent(r["Tidak Hadir"])
+    ids = absent_ids(r)
+    if ids is None:
+        return stored
+    roster = roster or get_roster()
+    # Nama di "Tidak Hadir" disimpan mengikut susunan yang sama dengan ID
+    if len(stored) != len(ids):
+        stored = [None] * len(ids)
+    return [roster.display(i) if i in roster.students or not name else name for i, name in zip(ids, stored)]
 
-        keyboard = [
-            [InlineKeyboardButton("📅 Hari Ini", callback_data="semak_tarikh|today")],
-            [InlineKeyboardButton("📆 Semalam", callback_data="semak_tarikh|yesterday")],
-            [InlineKeyboardButton("🗓 Pilih Tarikh", callback_data="semak_tarikh|calendar")],
-            [InlineKeyboardButton("📄 Export PDF Mingguan", callback_data="export_pdf_weekly")]
-        ]
 
-        await query.message.reply_text(
-            f"🏫 {kelas}\n\nPilih tarikh:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return
+def resolve_absent_ids(r, roster):
+    """ID murid tidak hadir; rekod lama dipadankan melalui nama dalam kelas yang sama."""
 
-    # ---------- SEMAK TARIKH ----------
-    if data.startswith("semak_tarikh|"):
-        choice = data.split("|")[1]
-        state = user_state[user_id]
-        kelas = state["semak_kelas"]
+    ids = absent_ids(r)
+    if ids is not None:
+        return ids
+    return [sid for sid in (roster.lookup(r["Kelas"], n) for n in parse_absent(r["Tidak Hadir"])) if sid is not None]
 
-        today = get_today_malaysia()
 
-        if choice == "calendar":
-            state["calendar_year"] = today.year
-            state["calendar_month"] = today.month
-            await show_calendar(query, user_id)
-            return
+def build_attendance_row(kelas, tarikh, hari, total, ids, roster=None):
+    """Baris sheet Kehadiran: nama (untuk bacaan manusia) + senarai ID padat (untuk bot)."""
 
-        target_date = today.strftime("%d/%m/%Y") if choice == "today" else \
-            (today - datetime.timedelta(days=1)).strftime("%d/%m/%Y")
+    roster = roster or get_roster()
+    names = [roster.display(i) for i in ids]
+    return [tarikh, hari, kelas, total - len(ids), total, ", ".join(names), encode_absent_ids(ids)]
 
-        await show_record_for_date(query, kelas, target_date)
-        return
 
-    # ---------- NAVIGASI BULAN ----------
-    if data.startswith("cal_nav|"):
-        _, year, month = data.split("|")
+def missing_student_ids(values):
+    if not values:
+        return False
+    if "ID" not in values[0]:
+        return len(values) > 1
+    col = values[0].index("ID")
+    return any(
+        not (row[col].strip() if len(row) > col else "").isdigit() and any(str(c).strip() for c in row)
+        for row in values[1:]
+    )
 
-        state = user_state[user_id]
-        year = int(year)
-        month = int(month)
 
-        if month == 0:
-            month = 12
-            year -= 1
-        elif month == 13:
-            month = 1
-            year += 1
+def assign_student_ids(values):
+    """Beri ID berturutan kepada baris tanpa ID; `values` (get_all_values 'Senarai Murid') dikemas kini di tempat."""
+
+    sheet_murid = tenant().sheet_murid
+    if not values:
+        return 0
+
+    header = values[0]
+    if "ID" in header:
+        col = header.index("ID") + 1
+    else:
+        col = len(header) + 1
+        sheet_murid.update_cell(1, col, "ID")
+        header.append("ID")
+
+    ids = []
+    for row in values[1:]:
+        cell = row[col - 1].strip() if len(row) >= col else ""
+        ids.append(int(cell) if cell.isdigit() else None)
+
+    next_id = max([i for i in ids if i is not None], default=0) + 1
+    assigned = 0
+    for i, sid in enumerate(ids):
+        if sid is None and any(str(c).strip() for c in values[i + 1]):
+            ids[i] = next_id
+            next_id += 1
+            assigned += 1
+
+    if assigned:
+        start = gspread.utils.rowcol_to_a1(2, col)
+        end = gspread.utils.rowcol_to_a1(len(ids) + 1, col)
+        own_write(lambda: sheet_murid.update(range_name=f"{start}:{end}", values=[[i if i is not None else ""] for i in ids]))
+
+    for row, sid in zip(values[1:], ids):
+        row.extend([""] * (col - len(row)))
+        row[col - 1] = str(sid) if sid is not None else ""
+
+    return assigned
+
+
+def ensure_student_ids():
+    """Beri ID berturutan kepada murid yang belum ada ID dalam 'Senarai Murid' (ID sedia ada tidak diubah)."""
+
+    t = tenant()
+    assigned = assign_student_ids(t.sheet_murid.get_all_values())
+    if assigned:
+        t.murid_cache["records"] = None
+
+    # Lajur ID dalam sheet Kehadiran
+    if t.sheet_kehadiran.acell("G1").value != "ID Tidak Hadir":
+        t.sheet_kehadiran.update_acell("G1", "ID Tidak Hadir")
+        t.kehadiran_mirror.invalidate()
+
+    return assigned
+
+
+def format_attendance(kelas, tarikh, hari, total, absent):
+    hadir = total - len(absent)
+
+    msg = (
+        f"🏫 {kelas}\n"
+        f"📅 {hari}\n"
+        f"🗓 {tarikh}\n\n"
+        f"📊 Kehadiran\n"
+        f"{hadir}/{total}\n"
+    )
+
+    if absent:
+        msg += f"\n❌ Tidak Hadir ({len(absent)} murid)\n"
+        for i, n in enumerate(absent, 1):
+            msg += f"{i}. {n}\n"
+    else:
+        msg += "\n🎉 Semua murid hadir.\n"
+
+    return msg
+
+
+def find_existing_row(kelas, tarikh):
+    """Nombor baris (Kelas, Tarikh) dari salinan delta; disahkan dengan bacaan satu baris sebelum digunakan."""
+
+    t = tenant()
+    t.kehadiran_mirror.refresh()
+    row = t.kehadiran_mirror.find_row(kelas, tarikh)
+    if row is None:
+        return None
+
+    check = t.sheet_kehadiran.get_values(f"A{row}:C{row}")
+    if check and len(check[0]) >= 3 and check[0][0] == tarikh and check[0][2] == kelas:
+        return row
+
+    # Salinan tidak selari (baris disisip / dipadam secara manual): baca penuh
+    t.kehadiran_mirror.refresh(full=True)
+    return t.kehadiran_mirror.find_row(kelas, tarikh)
+
+
+# ======================
+# ⚡ CACHE RESPONS PAPARAN (IKUT VERSI DATA)
+# ======================
+class ResponseCache:
+    """Cache LRU bagi paparan baca-sahaja; kunci = (paparan, parameter, versi data)."""
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.stats = {}
+
+    def get(self, view, params, build):
+        """Pulangkan paparan dari cache, atau bina dengan `build()` jika data telah berubah."""
+
+        # Segarkan salinan sheet (dalam TTL tiada panggilan API); perubahan menaikkan versi
+        get_murid_records()
+        get_kehadiran_records(KEHADIRAN_CACHE_TTL)
+
+        key = (view, params, tenant().data_version["n"])
+        stats = self.stats.setdefault(view, {"hit": 0, "miss": 0})
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            stats["hit"] += 1
+            return self.entries[key]
+
+        stats["miss"] += 1
+        value = build()
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return value
+
+    def metrics(self):
+        hits = sum(s["hit"] for s in self.stats.values())
+        misses = sum(s["miss"] for s in self.stats.values())
+        return {
+            "saiz": len(self.entries),
+            "hit": hits,
+            "miss": misses,
+            "kadar_hit": round(hits / (hits + misses), 3) if hits + misses else None,
+            "versi_data": tenant().data_version["n"],
+            "ikut_paparan": self.stats
+        }
+
+
+# ======================
+# 🔒 SIMPAN SERENTAK (KUNCI KELAS-HARI & IDEMPOTENSI)
+# ======================
+_class_day_locks = {}
+completed_saves = OrderedDict()
+COMPLETED_SAVES_MAX = 1000
+
+
+@asynccontextmanager
+async def class_day_lock(kelas, tarikh):
+    """Satu simpanan pada satu masa bagi setiap (Kelas, Tarikh)."""
+
+    key = (tenant().id, kelas.strip().lower(), tarikh)
+    entry = _class_day_locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _class_day_locks.pop(key, None)
+
+
+def new_save_token():
+    return secrets.token_hex(4)
+
+
+def mark_save_completed(token, msg):
+    completed_saves[token] = msg
+    while len(completed_saves) > COMPLETED_SAVES_MAX:
+        completed_saves.popitem(last=False)
+
+
+def upsert_attendance(values):
+    """Kemas kini baris (Kelas, Tarikh) sedia ada di tempatnya, atau tambah baris baharu."""
+
+    t = tenant()
+    tarikh, kelas = values[0], values[2]
+    row = find_existing_row(kelas, tarikh)
+
+    if row:
+        own_write(lambda: t.sheet_kehadiran.update(range_name=f"A{row}:G{row}", values=[values]))
+        t.kehadiran_mirror.apply_write(values, row)
+        return "update"
+
+    own_write(lambda: t.sheet_kehadiran.append_row(values))
+    t.kehadiran_mirror.apply_write(values)
+    return "insert"
+
+
+def find_duplicate_rows(records):
+    """{(kelas, tarikh): [nombor baris, ...]} bagi rekod yang muncul lebih dari sekali."""
+
+    groups = {}
+    for idx, r in enumerate(records, start=2):
+        key = (str(r["Kelas"]).strip().lower(), str(r["Tarikh"]).strip())
+        groups.setdefault(key, []).append(idx)
+    return {k: rows for k, rows in groups.items() if len(rows) > 1}
+
+
+def repair_duplicates(dry_run=False):
+    """Gabung rekod berganda: simpan baris terakhir (simpanan terkini), padam yang lain."""
+
+    sheet_kehadiran = tenant().sheet_kehadiran
+    duplicates = find_duplicate_rows(sheet_kehadiran.get_all_records())
+    to_delete = [n for rows in duplicates.values() for n in rows[:-1]]
+
+    if to_delete and not dry_run:
+        _delete_sheet_rows(sheet_kehadiran, to_delete)
+
+    return len(duplicates), len(to_delete)
+
+
+# ======================
+# 📒 JURNAL TULIS-DAHULU (MOD LUAR TALIAN)
+# ======================
+class AttendanceJournal:
+    """Log tambah-sahaja bagi setiap simpanan; dimainkan semula ke Sheets mengikut turutan."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.entries = None
+        self.synced = 0
+        self.last_seq = 0
+        self._merged = None
+        self.wakeup = asyncio.Event()
+        self.stats = {"dimainkan": 0, "ralat": None, "kadar_sesaat": None}
+
+    def load(self):
+        if self.entries is not None:
+            return
+
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path, encoding="utf-8") as f:
+                self.synced = json.load(f)["synced"]
+
+        self.entries = []
+        self.last_seq = self.synced
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # baris separuh ditulis semasa crash
+                    self.last_seq = max(self.last_seq, entry["seq"])
+                    if entry["seq"] > self.synced:
+                        self.entries.append(entry)
+
+    def append(self, values):
+        self.load()
+        self.last_seq += 1
+        entry = {"seq": self.last_seq, "values": values, "t": time_module.time()}
+
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.entries.append(entry)
+        self.wakeup.set()
+        return entry
+
+    def pending(self):
+        self.load()
+        return list(self.entries)
+
+    def has(self, kelas, tarikh):
+        return any(e["values"][2] == kelas and e["values"][0] == tarikh for e in self.pending())
+
+    def mark_synced(self, seq):
+        self.synced = seq
+        self.entries = [e for e in self.entries if e["seq"] > seq]
+
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"synced": seq}, f)
+        os.replace(tmp_path, self.offset_path)
+
+        # Semua sudah disegerak: kosongkan jurnal (seq terus menaik melalui fail offset)
+        if not self.entries:
+            open(self.path, "w").close()
+
+    def merge(self, records):
+        """Gabung rekod sheet dengan entri belum disegerak (entri jurnal menang)."""
+
+        pending = self.pending()
+        if not pending:
+            return records
+
+        # Hasil yang sama selagi sheet & jurnal tidak berubah (indeks bergantung pada identiti senarai)
+        cache_key = (id(records), self.synced, self.last_seq)
+        if self._merged is not None and self._merged[0] == cache_key and self._merged[1] is records:
+            return self._merged[2]
+
+        overrides = {}
+        for e in pending:
+            record = journal_record(_journal_values(e))
+            overrides[(record["Kelas"], record["Tarikh"])] = record
+
+        # Setiap baris (Kelas, Tarikh) diganti, termasuk pendua; entri tanpa baris ditambah di hujung
+        merged = []
+        used = set()
+        for r in records:
+            record_key = (r["Kelas"], r["Tarikh"])
+            if record_key in overrides:
+                merged.append(overrides[record_key])
+                used.add(record_key)
+            else:
+                merged.append(r)
+        merged.extend(v for k, v in overrides.items() if k not in used)
+        self._merged = (cache_key, records, merged)
+        return merged
+
+    def metrics(self):
+        pending = self.pending()
+        return dict(
+            self.stats,
+            belum_segerak=len(pending),
+            lag_saat=round(time_module.time() - pending[0]["t"], 1) if pending else 0
+        )
+
+
+
+
+def _journal_values(entry):
+    # Entri lama (sebelum lajur ID) hanya ada 6 nilai
+    values = list(entry["values"])
+    return values + [""] * (7 - len(values))
+
+
+def journal_record(values):
+    tarikh, hari, kelas, hadir, total, absent, ids = values
+    return {
+        "Tarikh": tarikh, "Hari": hari, "Kelas": kelas,
+        "Hadir": hadir, "Jumlah": total, "Tidak Hadir": absent, "ID Tidak Hadir": ids
+    }
+
+
+def save_attendance(kelas, tarikh, hari, total, ids):
+    """Tulis ke jurnal dahulu; Sheets dikemas kini oleh journal_replay_loop()."""
+
+    t = tenant()
+    values = build_attendance_row(kelas, tarikh, hari, total, ids)
+    entry = t.journal.append(values)
+    t.cube.apply(journal_record(values))
+    t.stats["simpanan"] += 1
+    bump_data_version()
+    return entry
+
+
+async def record_exists(kelas, tarikh):
+    """Jurnal dahulu; semakan Sheets dalam thread dengan had masa supaya event loop tidak tersekat."""
+
+    t = tenant()
+    if t.journal.has(kelas, tarikh):
+        return True
+    try:
+        row = await asyncio.wait_for(asyncio.to_thread(find_existing_row, kelas, tarikh), RECORD_CHECK_TIMEOUT)
+        return row is not None
+    except Exception:
+        # Sheets lambat / tidak dapat dicapai: semak salinan terakhir tanpa rangkaian
+        logger.warning("Semakan rekod %s %s gagal; guna salinan terakhir", kelas, tarikh, exc_info=True)
+        return any(r["Kelas"] == kelas and r["Tarikh"] == tarikh for r in t.kehadiran_mirror.records or [])
+
+
+async def journal_replay_loop(t):
+    """Main semula entri jurnal sekolah `t` ke Sheets satu demi satu; cuba semula dengan backoff jika gagal."""
+
+    set_tenant(t)
+    journal = t.journal
+    delay = 5
+    while True:
+        try:
+            await asyncio.wait_for(journal.wakeup.wait(), timeout=JOURNAL_RETRY_MAX)
+        except asyncio.TimeoutError:
+            pass
+        journal.wakeup.clear()
+
+        started = time_module.monotonic()
+        count = 0
+
+        for entry in journal.pending():
+            values = _journal_values(entry)
+            tarikh, kelas = values[0], values[2]
+            try:
+                async with class_day_lock(kelas, tarikh):
+                    await asyncio.to_thread(upsert_attendance, values)
+            except Exception as e:
+                journal.stats["ralat"] = repr(e)
+                logger.warning("Main semula jurnal gagal (seq %s), cuba lagi dalam %ds: %r", entry["seq"], delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, JOURNAL_RETRY_MAX)
+                journal.wakeup.set()
+                break
+
+            journal.mark_synced(entry["seq"])
+            journal.stats["dimainkan"] += 1
+            journal.stats["ralat"] = None
+            count += 1
+            delay = 5
+
+        if count:
+            elapsed = time_module.monotonic() - started
+            journal.stats["kadar_sesaat"] = round(count / elapsed, 2) if elapsed else None
+
+
+# ======================
+# 📮 BARISAN MESEJ KELUAR (RATE LIMIT TELEGRAM)
+# ======================
+TELEGRAM_MAX_LENGTH = 4096
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BROADCAST = 1
+
+
+def split_message(text, limit=TELEGRAM_MAX_LENGTH):
+    """Pecahkan teks kepada bahagian <= limit, pada sempadan baris jika boleh."""
+
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time_module.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class OutboundQueue:
+    """Penjadual mesej keluar: token bucket global + setiap chat (siaran sahaja), RetryAfter, keutamaan interaktif."""
+
+    def __init__(self, global_rate=30, private_rate=1, group_rate=20 / 60, max_attempts=4):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_attempts = max_attempts
+        self.chat_buckets = {}
+        self.queue = None
+        self.worker = None
+        self.seq = 0
+        self.stats = {"dihantar": 0, "gugur": 0, "retry_after": 0, "cuba_semula": 0}
+        self.latencies = deque(maxlen=500)
+
+    def _bucket(self, chat_id):
+        if chat_id not in self.chat_buckets:
+            # chat_id negatif = group/channel (had lebih ketat)
+            rate = self.group_rate if chat_id < 0 else self.private_rate
+            self.chat_buckets[chat_id] = TokenBucket(rate, max(1, rate * 3))
+        return self.chat_buckets[chat_id]
+
+    def _ensure_worker(self):
+        if self.worker is None or self.worker.done():
+            self.queue = self.queue or asyncio.PriorityQueue()
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _put(self, item):
+        self.seq += 1
+        self.queue.put_nowait((item["priority"], self.seq, item))
+
+    async def submit(self, chat_id, call, priority=PRIORITY_BROADCAST):
+        """Jadualkan `call()` (coroutine factory) untuk chat_id; tunggu sehingga dihantar."""
+
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._put({
+            "chat_id": chat_id, "call": call, "priority": priority,
+            "future": future, "enqueued": time_module.monotonic(), "attempts": 0
+        })
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, item = await self.queue.get()
+            now = time_module.monotonic()
+            bucket = self._bucket(item["chat_id"])
+            if item["priority"] == PRIORITY_INTERACTIVE:
+                # Balasan/edit interaktif: hanya had global + RetryAfter chat. Handler menunggu
+                # penghantaran dan update diproses berturutan, jadi bucket setiap chat di sini
+                # akan melambatkan guru lain juga.
+                wait = max(self.global_bucket.wait_time(now), bucket.blocked_until - now)
+            else:
+                wait = max(self.global_bucket.wait_time(now), bucket.wait_time(now))
+
+            if wait > 0:
+                # Jangan sekat chat lain: letak semula item ini selepas tempoh menunggu
+                loop.call_later(wait, self._put, item)
+                continue
+
+            self.global_bucket.consume()
+            if item["priority"] != PRIORITY_INTERACTIVE:
+                bucket.consume()
+            loop.create_task(self._deliver(item))
+
+    async def _deliver(self, item):
+        item["attempts"] += 1
+        try:
+            result = await item["call"]()
+        except RetryAfter as e:
+            self.stats["retry_after"] += 1
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            self._bucket(item["chat_id"]).blocked_until = time_module.monotonic() + retry_after
+            logger.warning("RetryAfter %ss untuk chat %s", retry_after, item["chat_id"])
+            self._put(item)
+            return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                result = None
+            else:
+                self._fail(item, e)
+                return
+        except (TimedOut, NetworkError) as e:
+            if item["attempts"] < self.max_attempts:
+                self.stats["cuba_semula"] += 1
+                asyncio.get_running_loop().call_later(2 ** item["attempts"], self._put, item)
+            else:
+                self._fail(item, e)
+            return
+        except Exception as e:
+            self._fail(item, e)
+            return
+
+        self.stats["dihantar"] += 1
+        self.latencies.append(time_module.monotonic() - item["enqueued"])
+        if not item["future"].done():
+            item["future"].set_result(result)
+
+    def _fail(self, item, error):
+        self.stats["gugur"] += 1
+        logger.warning("Mesej ke chat %s gugur: %r", item["chat_id"], error)
+        if not item["future"].done():
+            item["future"].set_exception(error)
+
+    async def send(self, bot, chat_id, text, priority=PRIORITY_BROADCAST, reply_markup=None):
+        """Hantar teks (dipecah jika > 4096 aksara); butang dilampirkan pada bahagian terakhir."""
+
+        chunks = split_message(text)
+        messages = []
+        for i, chunk in enumerate(chunks):
+            markup = reply_markup if i == len(chunks) - 1 else None
+            messages.append(await self.submit(
+                chat_id,
+                lambda chunk=chunk, markup=markup: bot.send_message(chat_id=chat_id, text=chunk, reply_markup=markup),
+                priority
+            ))
+        return messages
+
+    async def reply(self, message, text, reply_markup=None):
+        return await self.send(message.get_bot(), message.chat_id, text, PRIORITY_INTERACTIVE, reply_markup)
+
+    async def edit(self, query, text, reply_markup=None):
+        """Edit mesej butang; lebihan teks panjang dihantar sebagai mesej baharu."""
+
+        chunks = split_message(text)
+        first_markup = reply_markup if len(chunks) == 1 else None
+        result = await self.submit(
+            query.message.chat_id,
+            lambda: query.edit_message_text(chunks[0], reply_markup=first_markup),
+            PRIORITY_INTERACTIVE
+        )
+        if len(chunks) > 1:
+            await self.send(query.get_bot(), query.message.chat_id, "\n".join(chunks[1:]),
+                            PRIORITY_INTERACTIVE, reply_markup)
+        return result
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3) if latencies else None
+
+        return dict(self.stats, barisan=self.queue.qsize() if self.queue else 0, p50_saat=pct(0.5), p95_saat=pct(0.95))
+
+
+outbox = OutboundQueue()
+
+
+# ======================
+# 🔬 PROFILING (PILIHAN)
+# ======================
+# PROFILE_MODE: gabungan "cprofile", "tracemalloc", "stacks" (kosong = mati)
+# PROFILE_TARGETS: nama cabang button_handler (cth. "simpan,semak_rmt_today") atau "job:<id>"; "*" = semua
+profiling = {
+    "modes": {m.strip() for m in PROFILE_MODE.split(",") if m.strip()},
+    "targets": {t.strip() for t in PROFILE_TARGETS.split(",") if t.strip()} or {"*"}
+}
+PROFILE_MODES = ("cprofile", "tracemalloc", "stacks")
+folded_stacks = {}
+_cprofile_active = False
+
+
+class StackSampler:
+    """Sampel timbunan panggilan satu thread secara berkala (format 'folded' untuk flame graph)."""
+
+    def __init__(self, thread_id, counts, interval=0.005):
+        self.thread_id = thread_id
+        self.counts = counts
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def profiling_enabled(target):
+    return bool(profiling["modes"]) and ("*" in profiling["targets"] or target in profiling["targets"])
+
+
+def _profile_file(target, suffix, stamped=True):
+    # `target` boleh datang dari callback_data klien: hanya aksara selamat dalam nama fail
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in target)
+    if stamped:
+        safe += "_" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return os.path.join(PROFILE_DIR, f"{safe}{suffix}")
+
+
+@asynccontextmanager
+async def profile_section(target):
+    """Profil satu panggilan handler/tugasan jika mod profiling aktif untuk sasaran ini."""
+
+    global _cprofile_active
+
+    if not profiling_enabled(target):
+        yield
+        return
+
+    modes = profiling["modes"]
+    profiler = None
+    sampler = None
+    mem_before = None
+
+    # cProfile hanya satu sesi pada satu masa (panggilan bertindih diabaikan)
+    if "cprofile" in modes and not _cprofile_active:
+        _cprofile_active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if "tracemalloc" in modes:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        tracemalloc.reset_peak()
+        mem_before = tracemalloc.take_snapshot()
+
+    if "stacks" in modes:
+        sampler = StackSampler(threading.get_ident(), folded_stacks.setdefault(target, {}))
+        sampler.__enter__()
+
+    started = time_module.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time_module.perf_counter() - started
+
+        if profiler:
+            profiler.disable()
+            _cprofile_active = False
+            profiler.dump_stats(_profile_file(target, ".prof"))
+
+        if mem_before is not None:
+            _, peak = tracemalloc.get_traced_memory()
+            diff = tracemalloc.take_snapshot().compare_to(mem_before, "lineno")
+            with open(_profile_file(target, ".mem.txt"), "w", encoding="utf-8") as f:
+                f.write(f"{target}: {elapsed:.3f}s, puncak {peak / 1024:.1f} KiB\n\n")
+                for stat in diff[:25]:
+                    f.write(f"{stat}\n")
+
+        if sampler:
+            sampler.__exit__(None, None, None)
+            with open(_profile_file(target, ".folded", stamped=False), "w", encoding="utf-8") as f:
+                for stack, count in sorted(folded_stacks[target].items()):
+                    f.write(f"{stack} {count}\n")
+
+        logger.info("Profil %s: %.3fs", target, elapsed)
+
+
+def profiled(target):
+    """Decorator handler: `target` ialah nama tetap atau fungsi(update, context) → nama."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(update, context):
+            name = target(update, context) if callable(target) else target
+            async with profile_section(name):
+                return await fn(update, context)
+        return wrapper
+    return decorator
+
+
+async def profil_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profil on [mod,...] [sasaran,...] | /profil off | /profil (status)"""
+
+    if not is_admin(update.effective_user.id):
+        return
+
+    args = context.args or []
+
+    if args and args[0].lower() == "off":
+        profiling["modes"] = set()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    elif args and args[0].lower() == "on":
+        modes = {m for m in (args[1].split(",") if len(args) > 1 else ["cprofile"]) if m in PROFILE_MODES}
+        profiling["modes"] = modes or {"cprofile"}
+        profiling["targets"] = set(args[2].split(",")) if len(args) > 2 else {"*"}
+
+    files = len(os.listdir(PROFILE_DIR)) if os.path.isdir(PROFILE_DIR) else 0
+    status = "AKTIF" if profiling["modes"] else "MATI"
+    await outbox.reply(
+        update.message,
+        f"🔬 Profiling: {status}\n"
+        f"Mod: {', '.join(sorted(profiling['modes'])) or '-'}\n"
+        f"Sasaran: {', '.join(sorted(profiling['targets']))}\n"
+        f"Direktori: {PROFILE_DIR} ({files} fail)"
+    )
+
+
+# ======================
+# 🔔 SEMAK SEMUA KELAS & HANTAR KE GROUP
+# ======================
+async def check_all_classes_completed(context):
+
+    t = tenant()
+    if t.group_id is None:
+        return
+
+    today = get_today_malaysia()
+    tarikh = today.strftime("%d/%m/%Y")
+
+    # Simpanan bot sendiri sudah ada melalui jurnal; tiada bacaan Sheets pada setiap simpanan
+    records = get_kehadiran_records(KEHADIRAN_CACHE_TTL)
+
+    recorded = set()
+    for r in records:
+        if r["Tarikh"] == tarikh:
+            recorded.add(r["Kelas"].strip().lower())
+
+    belum = [k for k in t.classes if k.strip().lower() not in recorded]
+
+    if not belum:
+
+        msg = (
+            "✅ Kehadiran Lengkap Hari Ini\n\n"
+            f"📅 Tarikh: {tarikh}\n\n"
+            "Semua kelas telah berjaya merekod kehadiran.\n"
+            "Terima kasih atas kerjasama semua guru. 🙏\n\n"
+            f"📊 Sistem Tracker Kehadiran {t.nama}"
+        )
+
+        async def announce():
+            try:
+                await outbox.send(context.bot, t.group_id, msg)
+            except Exception:
+                logger.exception("Gagal menghantar makluman kehadiran lengkap")
+
+        # Mesej group beratur di belakang had kadar group; guru tidak perlu menunggunya
+        context.application.create_task(announce())
+
+
+# ======================
+# 🏫 PILIH SEKOLAH
+# ======================
+def school_picker():
+    keyboard = [[InlineKeyboardButton(t.nama, callback_data=f"sekolah|{t.id}")] for t in all_tenants()]
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def tenant_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tetapkan sekolah bagi setiap update; pengguna yang belum dikenali diminta memilih sekolah dahulu."""
+
+    query = update.callback_query
+    user_id = update.effective_user.id if update.effective_user else None
+
+    if query and query.data and query.data.startswith("sekolah|"):
+        t = TENANTS.get(query.data.split("|")[1])
+        await query.answer()
+        if t is not None:
+            remember_tenant(user_id, t)
+            set_tenant(t)
+            await outbox.edit(query, f"🏫 {t.nama} dipilih.\n\nTekan /start untuk mula.")
+        raise ApplicationHandlerStop
+
+    t = resolve_tenant(update.effective_chat.id if update.effective_chat else None, user_id)
+    if t is not None:
+        set_tenant(t)
+        t.stats["update"] += 1
+        return
+
+    if update.effective_message:
+        await outbox.reply(update.effective_message, "🏫 Sila pilih sekolah anda:", reply_markup=school_picker())
+    raise ApplicationHandlerStop
+
+
+async def sekolah_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/sekolah – tukar sekolah (bagi guru yang tidak disenaraikan oleh pentadbir)."""
+
+    if len(all_tenants()) > 1:
+        await outbox.reply(update.message, f"🏫 Sekolah semasa: {tenant().nama}\n\nPilih sekolah:", reply_markup=school_picker())
+
+
+# ======================
+# START / MENU UTAMA
+# ======================
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    inline_keyboard = [
+    [InlineKeyboardButton("📋 Rekod Kehadiran", callback_data="rekod")],
+    [InlineKeyboardButton("🔍 Semak Kehadiran", callback_data="semak")],
+    [InlineKeyboardButton("🍱 Semak RMT Hari Ini", callback_data="semak_rmt_today")],
+    [InlineKeyboardButton("📊 Statistik Kehadiran", callback_data="smart_statistik")],
+    [InlineKeyboardButton("🏫 Kehadiran Ikut Tahun", callback_data="kiub")]
+    ]
+
+    reply_keyboard = ReplyKeyboardMarkup(
+        [
+            [KeyboardButton("🏠 Menu Utama")],
+            [KeyboardButton("📊 Dashboard")]
+        ],
+        resize_keyboard=True
+    )
+    quote = get_random_quote()
+
+    text = (
+        f"🏫 Tracker Kehadiran Murid {tenant().nama}\n\n"
+        f"💬 {quote}\n\n"
+        "Pilih menu:"
+    )
+
+    await outbox.reply(update.message, text, reply_markup=InlineKeyboardMarkup(inline_keyboard))
+    await outbox.reply(
+        update.message,
+        "🏠 Tekan butang di bawah untuk kembali ke Menu Utama",
+        reply_markup=reply_keyboard
+    )
+
+
+# ======================
+# 🍱 LAPORAN RMT HARI INI
+# ======================
+def build_rmt_today_message(tarikh):
+
+    roster = get_roster()
+
+    # ======================
+    # BINA DATA RMT (ikut ID murid)
+    # ======================
+    all_rmt_students = {sid for sid, m in roster.students.items() if m["rmt"]}
+
+    # ======================
+    # SEMAK KEHADIRAN
+    # ======================
+    hadir_records = get_kehadiran_records(KEHADIRAN_CACHE_TTL)
+    tidak_hadir_by_class = {}
+
+    for r in hadir_records:
+        if r["Tarikh"] == tarikh:
+            kelas = r["Kelas"]
+
+            for sid in resolve_absent_ids(r, roster):
+                if sid in all_rmt_students:
+                    tidak_hadir_by_class.setdefault(kelas, []).append(roster.students[sid]["nama_pendek"])
+
+    # ======================
+    # KIRAAN
+    # ======================
+    total_rmt = len(all_rmt_students)
+    total_tidak_hadir = sum(len(v) for v in tidak_hadir_by_class.values())
+    hadir_rmt = total_rmt - total_tidak_hadir
+
+    # ======================
+    # PAPARAN
+    # ======================
+    msg = (
+        "🍱 Laporan Kehadiran RMT Hari Ini\n\n"
+        f"📅 {tarikh}\n"
+        f"📊 Hadir: {hadir_rmt} / {total_rmt}\n"
+    )
+
+    if tidak_hadir_by_class:
+        msg += f"\n❌ Tidak Hadir ({total_tidak_hadir} murid)\n"
+
+        for kelas in sorted(tidak_hadir_by_class):
+            murid = tidak_hadir_by_class[kelas]
+            msg += f"\n🏫 {kelas}\n"
+            for i, nama in enumerate(murid, 1):
+                msg += f"{i}. {nama}\n"
+    else:
+        msg += "\n🎉 Semua murid RMT hadir hari ini.\n"
+
+    return msg
+
+
+# ======================
+# BUTTON HANDLER
+# ======================
+@profiled(lambda update, context: update.callback_query.data.split("|")[0])
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+    data = query.data
+
+    if not await ensure_ready():
+        await outbox.edit(query, "⏳ Sistem sedang dimulakan. Sila cuba sebentar lagi.")
+        return
+
+    if data == "semak_rmt_today":
+        tarikh = get_today_malaysia().strftime("%d/%m/%Y")
+        msg = tenant().response_cache.get("rmt", tarikh, lambda: build_rmt_today_message(tarikh))
+        await outbox.edit(query, msg)
+        return
+
+    if data == "smart_statistik":
+        await show_smart_dashboard(query)
+        return
+
+    if data == "kiub" or data.startswith("kiub|"):
+        await show_cube_view(query, data)
+        return
+
+
+    # ---------- REKOD ----------
+    if data == "rekod":
+        markup = tenant().response_cache.get("pilih_kelas", "kelas", lambda: build_class_picker("kelas"))
+        await outbox.edit(query, "Pilih kelas:", reply_markup=markup)
+        return
+
+    if data.startswith("kelas|"):
+        kelas = data.split("|")[1]
+        students = list(get_roster().by_class.get(kelas, []))
+
+        today = get_today_malaysia()
+        tarikh = today.strftime("%d/%m/%Y")
+        hari = today.strftime("%A")
+
+        user_state[user_id] = {
+            "kelas": kelas,
+            "tarikh": tarikh,
+            "hari": hari,
+            "students": students,
+            "absent": [],
+            "token": new_save_token()
+        }
+
+        await show_student_buttons(query, user_id)
+        return
+
+    # ---------- PILIH MURID ----------
+    if data.startswith("murid|"):
+        state = user_state[user_id]
+
+        try:
+            sid = int(data.split("|")[1])
+        except ValueError:
+            # Butang lama (sebelum ID murid): papar semula senarai terkini
+            sid = None
+
+        if sid in state["absent"]:
+            state["absent"].remove(sid)
+        elif sid in state["students"]:
+            state["absent"].append(sid)
+
+        await show_student_buttons(query, user_id)
+        return
+
+    # ---------- RESET ----------
+    if data == "reset":
+        user_state[user_id]["absent"] = []
+        await show_student_buttons(query, user_id)
+        return
+
+    # ---------- SIMPAN / SEMUA HADIR ----------
+    if data.split("|")[0] in ["simpan", "semua_hadir"]:
+
+        action, _, token = data.partition("|")
+
+        # Tekan berganda / callback diulang: paparkan semula keputusan asal
+        if token in completed_saves:
+            await outbox.edit(query, completed_saves[token])
+            return
+
+        state = user_state[user_id]
+        kelas = state["kelas"]
+        tarikh = state["tarikh"]
+        hari = state["hari"]
+        total = len(state["students"])
+
+        absent = [] if action == "semua_hadir" else list(state["absent"])
+
+        async with class_day_lock(kelas, tarikh):
+
+            if token in completed_saves:
+                await outbox.edit(query, completed_saves[token])
+                return
+
+            if await record_exists(kelas, tarikh):
+                user_state[user_id]["pending_overwrite"] = {
+                    "kelas": kelas,
+                    "tarikh": tarikh,
+                    "hari": hari,
+                    "total": total,
+                    "absent": absent
+                }
+
+                keyboard = [[
+                    InlineKeyboardButton("✅ Ya, Overwrite", callback_data=f"confirm_overwrite|{token}"),
+                    InlineKeyboardButton("❌ Batal", callback_data="cancel_overwrite")
+                ]]
+
+                await outbox.edit(
+                    query,
+                    f"⚠️ Rekod kehadiran untuk\n\n🏫 {kelas}\n🗓 {tarikh}\n\nsudah wujud.\n\nAdakah anda mahu overwrite?",
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+                return
+
+            save_attendance(kelas, tarikh, hari, total, absent)
+            roster = get_roster()
+            msg = "✅ Kehadiran berjaya disimpan!\n\n" + \
+                format_attendance(kelas, tarikh, hari, total, [roster.display(i) for i in absent])
+            mark_save_completed(token, msg)
+
+        await outbox.edit(query, msg)
+
+        # 🔔 PANGGIL SEMAK GROUP
+        await check_all_classes_completed(context)
+        schedule_dashboard_snapshot(context)
+
+        user_state.pop(user_id, None)
+        return
+
+    # ---------- CONFIRM OVERWRITE ----------
+    if data.split("|")[0] == "confirm_overwrite":
+
+        token = data.partition("|")[2]
+
+        if token in completed_saves:
+            await outbox.edit(query, completed_saves[token])
+            return
+
+        info = user_state[user_id]["pending_overwrite"]
+
+        async with class_day_lock(info["kelas"], info["tarikh"]):
+
+            if token in completed_saves:
+                await outbox.edit(query, completed_saves[token])
+                return
+
+            save_attendance(info["kelas"], info["tarikh"], info["hari"], info["total"], info["absent"])
+            roster = get_roster()
+            msg = "🔄 Rekod berjaya dioverwrite!\n\n" + format_attendance(
+                info["kelas"], info["tarikh"], info["hari"], info["total"],
+                [roster.display(i) for i in info["absent"]]
+            )
+            mark_save_completed(token, msg)
+
+        await outbox.edit(query, msg)
+
+        # 🔔 PANGGIL SEMAK GROUP
+        await check_all_classes_completed(context)
+        schedule_dashboard_snapshot(context)
+
+        user_state.pop(user_id, None)
+        return
+
+    # ---------- BATAL OVERWRITE ----------
+    if data == "cancel_overwrite":
+        await outbox.edit(query, "❌ Overwrite dibatalkan. Rekod asal dikekalkan.")
+        user_state.pop(user_id, None)
+        return
+
+    # ---------- SEMAK ----------
+    if data == "semak":
+        markup = tenant().response_cache.get("pilih_kelas", "semak_kelas", lambda: build_class_picker("semak_kelas"))
+        await outbox.edit(query, "Pilih kelas untuk semak:", reply_markup=markup)
+        return
+
+    # ---------- EXPORT PDF ----------
+    if data == "export_pdf_weekly":
+        await export_pdf_weekly(query)
+        return
+
+    if data.startswith("export_pdf|"):
+        await export_pdf_period(query, data.split("|")[1])
+        return
+
+    # ---------- PILIH KELAS SEMAK ----------
+    if data.startswith("semak_kelas|"):
+        kelas = data.split("|")[1]
+        user_state[user_id] = {"semak_kelas": kelas}
+
+        keyboard = [
+            [InlineKeyboardButton("📅 Hari Ini", callback_data="semak_tarikh|today")],
+            [InlineKeyboardButton("📆 Semalam", callback_data="semak_tarikh|yesterday")],
+            [InlineKeyboardButton("🗓 Pilih Tarikh", callback_data="semak_tarikh|calendar")],
+            [InlineKeyboardButton("📄 Export PDF Mingguan", callback_data="export_pdf_weekly")]
+        ]
+
+        await outbox.reply(
+            query.message,
+            f"🏫 {kelas}\n\nPilih tarikh:",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+
+    # ---------- SEMAK TARIKH ----------
+    if data.startswith("semak_tarikh|"):
+        choice = data.split("|")[1]
+        state = user_state[user_id]
+        kelas = state["semak_kelas"]
+
+        today = get_today_malaysia()
+
+        if choice == "calendar":
+            state["calendar_year"] = today.year
+            state["calendar_month"] = today.month
+            await show_calendar(query, user_id)
+            return
+
+        target_date = today.strftime("%d/%m/%Y") if choice == "today" else \
+            (today - datetime.timedelta(days=1)).strftime("%d/%m/%Y")
+
+        await show_record_for_date(query, kelas, target_date)
+        return
+
+    # ---------- NAVIGASI BULAN ----------
+    if data.startswith("cal_nav|"):
+        _, year, month = data.split("|")
+
+        state = user_state[user_id]
+        year = int(year)
+        month = int(month)
+
+        if month == 0:
+            month = 12
+            year -= 1
+        elif month == 13:
+            month = 1
+            year += 1
 
         state["calendar_year"] = year
         state["calendar_month"] = month
 
-        await show_calendar(query, user_id)
+        await show_calendar(query, user_id)
+        return
+
+    # ---------- PILIH HARI ----------
+    if data.startswith("cal_day|"):
+        _, year, month, day = data.split("|")
+
+        target_date = f"{int(day):02d}/{int(month):02d}/{year}"
+        state = user_state[user_id]
+        kelas = state["semak_kelas"]
+
+        await show_record_for_date(query, kelas, target_date)
+        return
+
+
+# ======================
+# PILIH KELAS
+# ======================
+def build_class_picker(action):
+
+    records = get_murid_records()
+    kelas_list = sorted(set(r["Kelas"] for r in records))
+
+    keyboard = []
+    row = []
+
+    for k in kelas_list:
+        row.append(InlineKeyboardButton(k, callback_data=f"{action}|{k}"))
+        if len(row) == 3:
+            keyboard.append(row)
+            row = []
+
+    if row:
+        keyboard.append(row)
+
+    if action == "semak_kelas":
+        keyboard.append([
+            InlineKeyboardButton("📄 Export PDF Mingguan", callback_data="export_pdf_weekly")
+        ])
+        keyboard.append([
+            InlineKeyboardButton("📄 Laporan Bulanan", callback_data="export_pdf|bulanan"),
+            InlineKeyboardButton("📄 Laporan Penggal", callback_data="export_pdf|penggal")
+        ])
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+# ======================
+# SHOW STUDENT BUTTONS
+# ======================
+async def show_student_buttons(query, user_id):
+
+    state = user_state[user_id]
+    roster = get_roster()
+
+    msg = format_attendance(
+        state["kelas"],
+        state["tarikh"],
+        state["hari"],
+        len(state["students"]),
+        [roster.display(i) for i in state["absent"]]
+    )
+
+    keyboard = []
+    for sid in state["students"]:
+        n = roster.display(sid)
+        label = f"🔴 {n}" if sid in state["absent"] else f"🟢 {n}"
+        keyboard.append([InlineKeyboardButton(label, callback_data=f"murid|{sid}")])
+
+    keyboard.append([
+        InlineKeyboardButton("💾 Simpan", callback_data=f"simpan|{state['token']}"),
+        InlineKeyboardButton("♻️ Reset", callback_data="reset"),
+        InlineKeyboardButton("✅ Semua Hadir", callback_data=f"semua_hadir|{state['token']}")
+    ])
+
+    await outbox.edit(query, msg, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+# ======================
+# SHOW CALENDAR
+# ======================
+def render_calendar(kelas, year, month, today, index):
+    """Papan kekunci bulan dengan penanda: ✅ ada rekod, ❌ hari sekolah tanpa rekod, 🟢 hari ini."""
+
+    first_day = datetime.date(year, month, 1)
+    start_weekday = first_day.weekday()
+    days_in_month = (datetime.date(year + (month // 12), ((month % 12) + 1), 1) - datetime.timedelta(days=1)).day
+    recorded = index.dates(kelas)
+
+    keyboard = []
+
+    keyboard.append([
+        InlineKeyboardButton("⬅️", callback_data=f"cal_nav|{year}|{month-1 if month>1 else 12}"),
+        InlineKeyboardButton(f"{first_day.strftime('%B')} {year}", callback_data="noop"),
+        InlineKeyboardButton("➡️", callback_data=f"cal_nav|{year}|{month+1 if month<12 else 1}")
+    ])
+
+    weekdays = ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
+    keyboard.append([InlineKeyboardButton(d, callback_data="noop") for d in weekdays])
+
+    row = []
+    for _ in range(start_weekday):
+        row.append(InlineKeyboardButton(" ", callback_data="noop"))
+
+    for day in range(1, days_in_month + 1):
+
+        d = datetime.date(year, month, day)
+        callback = f"cal_day|{year}|{month}|{day}"
+
+        if d in recorded:
+            label = f"{day}✅"
+        elif d == today:
+            label = f"{day}🟢"
+        elif d.weekday() >= 5 or d > today:
+            # Hujung minggu / hari akan datang tanpa rekod: tiada apa untuk dipaparkan
+            label = str(day)
+            callback = "noop"
+        else:
+            label = f"{day}❌"
+
+        row.append(InlineKeyboardButton(label, callback_data=callback))
+
+        if len(row) == 7:
+            keyboard.append(row)
+            row = []
+
+    if row:
+        while len(row) < 7:
+            row.append(InlineKeyboardButton(" ", callback_data="noop"))
+        keyboard.append(row)
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def show_calendar(query, user_id):
+
+    state = user_state[user_id]
+    kelas = state["semak_kelas"]
+    year = state["calendar_year"]
+    month = state["calendar_month"]
+    today = get_today_malaysia()
+
+    # Papan kekunci dibina semula hanya apabila data berubah (versi baharu) atau hari bertukar
+    markup = tenant().response_cache.get(
+        "kalendar", (kelas, year, month, today),
+        lambda: render_calendar(kelas, year, month, today, get_attendance_index())
+    )
+
+    await outbox.edit(
+        query,
+        f"🗓 {kelas} — pilih tarikh:\n✅ ada rekod  ❌ belum direkod  🟢 hari ini",
+        reply_markup=markup
+    )
+
+
+# ======================
+# SHOW RECORD FOR DATE
+# ======================
+def build_record_for_date(kelas, target_date):
+
+    r = get_attendance_index().get(kelas, parse_tarikh(target_date))
+
+    if r is not None:
+        msg = format_attendance(
+            kelas,
+            r["Tarikh"],
+            r["Hari"],
+            r["Jumlah"],
+            absent_names(r)
+        )
+        return msg, None
+
+    keyboard = [
+        [InlineKeyboardButton("📅 Hari Ini", callback_data="semak_tarikh|today")],
+        [InlineKeyboardButton("📆 Semalam", callback_data="semak_tarikh|yesterday")],
+        [InlineKeyboardButton("🗓 Pilih Tarikh", callback_data="semak_tarikh|calendar")],
+        [InlineKeyboardButton("📄 Export PDF Mingguan", callback_data="export_pdf_weekly")]
+    ]
+    return "❌ Tiada rekod untuk tarikh ini.\n\nPilih tarikh lain:", InlineKeyboardMarkup(keyboard)
+
+
+async def show_record_for_date(query, kelas, target_date):
+
+    msg, markup = tenant().response_cache.get(
+        "rekod_tarikh", (kelas, target_date), lambda: build_record_for_date(kelas, target_date)
+    )
+
+    try:
+        await outbox.edit(query, msg, reply_markup=markup)
+    except Exception:
+        pass
+
+
+# ======================
+# EXPORT PDF MINGGUAN
+# ======================
+async def export_pdf_weekly(query):
+
+    today = get_today_malaysia()
+    start = today - datetime.timedelta(days=(today.weekday() + 1) % 7)
+
+    records = get_kehadiran_records()
+    styles = getSampleStyleSheet()
+
+    file_path = f"/tmp/Rekod_Kehadiran_Mingguan_{tenant().id}.pdf"
+    doc = SimpleDocTemplate(file_path)
+    story = []
+
+    story.append(Paragraph(f"Rekod Kehadiran Murid {tenant().nama}", styles["Title"]))
+    story.append(Paragraph("Laporan Mingguan", styles["Heading2"]))
+    story.append(Spacer(1, 12))
+
+    ada_data = False
+
+    for i in range(7):
+        day = start + datetime.timedelta(days=i)
+        tarikh = day.strftime("%d/%m/%Y")
+        hari = day.strftime("%A")
+
+        daily = [r for r in records if r["Tarikh"] == tarikh]
+        if not daily:
+            continue
+
+        ada_data = True
+
+        story.append(Paragraph(f"{hari}  |  {tarikh}", styles["Heading2"]))
+        story.append(Spacer(1, 8))
+
+        for r in sorted(daily, key=lambda x: x["Kelas"]):
+            absent = absent_names(r)
+            hadir = int(r["Jumlah"]) - len(absent)
+
+            story.append(Paragraph(f"<b>Kelas : {r['Kelas']}</b>", styles["Heading3"]))
+            story.append(Paragraph(f"Hari : {hari}", styles["Normal"]))
+            story.append(Paragraph(f"Tarikh : {tarikh}", styles["Normal"]))
+            story.append(Spacer(1, 4))
+
+            story.append(Paragraph(f"Kehadiran : {hadir} / {r['Jumlah']}", styles["Normal"]))
+
+            if absent:
+                story.append(Paragraph("Tidak Hadir:", styles["Normal"]))
+                for idx, name in enumerate(absent, 1):
+                    story.append(Paragraph(f"{idx}. {name}", styles["Normal"]))
+            else:
+                story.append(Paragraph("Semua murid hadir", styles["Normal"]))
+
+            story.append(Spacer(1, 12))
+
+    if not ada_data:
+        story.append(Paragraph(
+            "Tiada rekod kehadiran direkodkan setakat ini untuk minggu ini.",
+        styles["Normal"]
+    ))
+        story.append(Spacer(1, 12))
+
+    # 📊 Bar Chart Ranking Mingguan
+    summary, top3 = generate_weekly_summary()
+
+    if top3:
+
+        drawing = Drawing(400, 200)
+        chart = VerticalBarChart()
+        chart.x = 50
+        chart.y = 50
+        chart.height = 125
+        chart.width = 300
+
+        chart.data = [[p for _, p in top3]]
+        chart.categoryAxis.categoryNames = [k for k, _ in top3]
+        chart.valueAxis.valueMin = 0
+        chart.valueAxis.valueMax = 100
+
+        drawing.add(chart)
+        story.append(Spacer(1, 20))
+        story.append(Paragraph("Graf Top 3 Kehadiran Mingguan", styles["Heading2"]))
+        story.append(drawing)
+        
+    doc.build(story)
+
+    await query.message.reply_document(
+        document=open(file_path, "rb"),
+        filename="Rekod_Kehadiran_Mingguan.pdf",
+        caption="📄 Rekod Kehadiran Mingguan"
+    )
+
+# ======================
+# 📄 LAPORAN PDF BULANAN & PENGGAL (SELARI)
+# ======================
+_report_pool = None
+
+
+def get_terms(year):
+    """Tarikh penggal dari PENGGAL_JSON; lalai dua separuh tahun kalendar."""
+
+    if PENGGAL_JSON:
+        terms = []
+        for t in json.loads(PENGGAL_JSON):
+            start, end = parse_tarikh(t["mula"]), parse_tarikh(t["tamat"])
+            if start and end:
+                terms.append((t["nama"], start, end))
+        return terms
+
+    return [
+        ("Penggal 1", datetime.date(year, 1, 1), datetime.date(year, 6, 30)),
+        ("Penggal 2", datetime.date(year, 7, 1), datetime.date(year, 12, 31)),
+    ]
+
+
+def get_report_period(jenis, today):
+    if jenis == "bulanan":
+        start = today.replace(day=1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+        return f"Laporan Bulanan {start.strftime('%B %Y')}", start, end
+
+    terms = get_terms(today.year)
+    for nama, start, end in terms:
+        if start <= today <= end:
+            return f"Laporan {nama} {today.year}", start, end
+
+    # Cuti antara penggal: guna penggal terakhir yang sudah bermula
+    past = [t for t in terms if t[1] <= today] or terms
+    nama, start, end = past[-1]
+    return f"Laporan {nama} {start.year}", start, end
+
+
+def collect_report_data(start, end):
+    """{kelas: [[tarikh, hari, hadir, jumlah, [tidak hadir]], ...]} ikut kronologi."""
+
+    roster = get_roster()
+    per_kelas = {}
+    for r in iter_attendance(start, end):
+        try:
+            jumlah = int(r["Jumlah"])
+        except (ValueError, TypeError):
+            continue
+        if jumlah <= 0:
+            continue
+
+        absent = absent_names(r, roster)
+        per_kelas.setdefault(r["Kelas"], []).append(
+            [r["Tarikh"], r["Hari"], jumlah - len(absent), jumlah, absent]
+        )
+
+    for rows in per_kelas.values():
+        rows.sort(key=lambda x: parse_tarikh(x[0]))
+    return per_kelas
+
+
+def _payload_hash(payload):
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def render_summary_section(payload):
+    """Halaman pertama: ringkasan sekolah + graf kadar semua kelas. Dijalankan dalam proses pekerja."""
+
+    title, period, rates, path = payload["title"], payload["period"], payload["rates"], payload["path"]
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph(f"Rekod Kehadiran Murid {payload['sekolah']}", styles["Title"]),
+        Paragraph(title, styles["Heading2"]),
+        Paragraph(period, styles["Normal"]),
+        Spacer(1, 12),
+    ]
+
+    if not rates:
+        story.append(Paragraph("Tiada rekod kehadiran dalam tempoh ini.", styles["Normal"]))
+    else:
+        hadir = sum(r[1] for r in rates)
+        total = sum(r[2] for r in rates)
+        story.append(Paragraph(f"Kehadiran keseluruhan : {hadir} / {total} ({_rate(hadir, total):.1f}%)", styles["Normal"]))
+        story.append(Spacer(1, 12))
+
+        drawing = Drawing(450, 230)
+        chart = VerticalBarChart()
+        chart.x = 40
+        chart.y = 60
+        chart.height = 150
+        chart.width = 400
+        chart.data = [[_rate(h, t) for _, h, t in rates]]
+        chart.categoryAxis.categoryNames = [k for k, _, _ in rates]
+        chart.categoryAxis.labels.angle = 90
+        chart.categoryAxis.labels.boxAnchor = "e"
+        chart.categoryAxis.labels.fontSize = 7
+        chart.valueAxis.valueMin = 0
+        chart.valueAxis.valueMax = 100
+        drawing.add(chart)
+
+        story.append(Paragraph("Graf Kehadiran Mengikut Kelas", styles["Heading2"]))
+        story.append(drawing)
+        story.append(Spacer(1, 12))
+
+        table = [["#", "Kelas", "Hadir / Jumlah", "%"]]
+        ranked = sorted(rates, key=lambda r: _rate(r[1], r[2]), reverse=True)
+        for i, (k, h, t) in enumerate(ranked, 1):
+            table.append([str(i), k, f"{h} / {t}", f"{_rate(h, t):.1f}"])
+        story.append(_styled_table(table, [30, 150, 120, 60]))
+
+    if payload.get("tahun"):
+        story.append(Spacer(1, 12))
+        story.append(Paragraph("Kehadiran Mengikut Tahun", styles["Heading2"]))
+        table = [["Tahun", "Hadir / Jumlah", "%"]]
+        for label, h, t in payload["tahun"]:
+            table.append([label, f"{h} / {t}", f"{_rate(h, t):.1f}"])
+        story.append(_styled_table(table, [180, 120, 60]))
+
+    SimpleDocTemplate(path).build(story)
+    return path
+
+
+def render_class_section(payload):
+    """Seksyen satu kelas: ringkasan, graf trend harian dan jadual ketidakhadiran."""
+
+    kelas, rows, path = payload["kelas"], payload["rows"], payload["path"]
+    styles = getSampleStyleSheet()
+    story = [Paragraph(f"Kelas : {kelas}", styles["Heading1"])]
+
+    hadir = sum(r[2] for r in rows)
+    total = sum(r[3] for r in rows)
+    story.append(Paragraph(
+        f"Hari direkod : {len(rows)} | Kehadiran : {hadir} / {total} ({_rate(hadir, total):.1f}%)",
+        styles["Normal"]
+    ))
+    story.append(Spacer(1, 12))
+
+    # 📈 Trend harian
+    points = [(i + 1, _rate(r[2], r[3])) for i, r in enumerate(rows)]
+    if len(points) >= 2:
+        drawing = Drawing(450, 180)
+        plot = LinePlot()
+        plot.x = 40
+        plot.y = 30
+        plot.height = 130
+        plot.width = 390
+        plot.data = [points]
+        plot.lines[0].strokeColor = colors.darkblue
+        plot.xValueAxis.valueMin = 1
+        plot.xValueAxis.valueMax = len(points)
+        plot.yValueAxis.valueMin = 0
+        plot.yValueAxis.valueMax = 100
+        drawing.add(plot)
+
+        story.append(Paragraph("Trend Kehadiran Harian (%)", styles["Heading3"]))
+        story.append(drawing)
+        story.append(Spacer(1, 12))
+
+    # ❌ Murid paling kerap tidak hadir
+    kekerapan = {}
+    for r in rows:
+        for name in r[4]:
+            kekerapan[name] = kekerapan.get(name, 0) + 1
+
+    if kekerapan:
+        top = sorted(kekerapan.items(), key=lambda x: x[1], reverse=True)[:10]
+        story.append(Paragraph("Kekerapan Tidak Hadir", styles["Heading3"]))
+        story.append(_styled_table([["Nama", "Hari"]] + [[n, str(c)] for n, c in top], [300, 60]))
+        story.append(Spacer(1, 12))
+
+    # 🗓 Jadual harian
+    table = [["Tarikh", "Hadir", "Tidak Hadir"]]
+    for tarikh, hari, h, t, absent in rows:
+        table.append([
+            Paragraph(f"{tarikh}<br/>{hari}", styles["Normal"]),
+            f"{h} / {t}",
+            Paragraph(", ".join(absent) or "Semua hadir", styles["Normal"])
+        ])
+    story.append(Paragraph("Rekod Harian", styles["Heading3"]))
+    story.append(_styled_table(table, [80, 60, 320]))
+
+    SimpleDocTemplate(path).build(story)
+    return path
+
+
+def _styled_table(data, col_widths):
+    table = Table(data, colWidths=col_widths, repeatRows=1)
+    table.setStyle(TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+    ]))
+    return table
+
+
+def _get_report_pool():
+    global _report_pool
+    if _report_pool is None:
+        _report_pool = ProcessPoolExecutor(max_workers=REPORT_WORKERS)
+    return _report_pool
+
+
+def _prune_report_cache(max_age_days=30):
+    cutoff = time_module.time() - max_age_days * 86400
+    for name in os.listdir(REPORT_CACHE_DIR):
+        path = os.path.join(REPORT_CACHE_DIR, name)
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+
+
+def _merge_pdfs(paths, out_path):
+    writer = PdfWriter()
+    for p in paths:
+        writer.append(p)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        writer.write(f)
+    os.replace(tmp_path, out_path)
+
+
+async def build_period_report(jenis, today=None):
+    """Jana (atau ambil dari cache) laporan bulanan/penggal. Pulangkan (laluan, tajuk)."""
+
+    today = today or get_today_malaysia()
+    title, start, end = get_report_period(jenis, today)
+    period = f"{start.strftime('%d/%m/%Y')} - {end.strftime('%d/%m/%Y')}"
+
+    per_kelas = await asyncio.to_thread(collect_report_data, start, end)
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    _prune_report_cache()
+
+    # Laporan siap dicache ikut kandungan; seksyen kelas yang tidak berubah juga diguna semula
+    t = tenant()
+    report_key = _payload_hash([t.nama, title, period, per_kelas])
+    report_path = os.path.join(REPORT_CACHE_DIR, f"laporan_{report_key}.pdf")
+    if os.path.exists(report_path):
+        return report_path, title
+
+    kelas_order = [k for k in t.classes if k in per_kelas] + sorted(k for k in per_kelas if k not in t.classes)
+    rates = [(k, sum(r[2] for r in per_kelas[k]), sum(r[3] for r in per_kelas[k])) for k in kelas_order]
+
+    # Rollup tahun dari kiub (sel bulan / hari), bukan dari baris mentah
+    cube = await asyncio.to_thread(get_cube)
+    tahun = []
+    for y in year_levels(t.classes):
+        hadir, total, _ = cube.range_stat(start, end, "tahun", y)
+        if total:
+            tahun.append((year_label(y), hadir, total))
+
+    jobs = [(render_summary_section, {"sekolah": t.nama, "title": title, "period": period, "rates": rates, "tahun": tahun})]
+    jobs += [(render_class_section, {"kelas": k, "rows": per_kelas[k]}) for k in kelas_order]
+
+    loop = asyncio.get_running_loop()
+    pool = _get_report_pool()
+    futures = []
+    for fn, payload in jobs:
+        payload["path"] = os.path.join(REPORT_CACHE_DIR, f"seksyen_{fn.__name__}_{_payload_hash(payload)}.pdf")
+        if os.path.exists(payload["path"]):
+            futures.append(asyncio.sleep(0, result=payload["path"]))
+        else:
+            futures.append(loop.run_in_executor(pool, fn, payload))
+
+    section_paths = await asyncio.gather(*futures)
+    await asyncio.to_thread(_merge_pdfs, section_paths, report_path)
+
+    return report_path, title
+
+
+async def export_pdf_period(query, jenis):
+
+    await outbox.reply(query.message, "⏳ Laporan sedang dijana...")
+
+    try:
+        path, title = await build_period_report(jenis)
+    except Exception:
+        logger.exception("Gagal menjana laporan %s", jenis)
+        await outbox.reply(query.message, "❌ Laporan gagal dijana. Sila cuba sebentar lagi.")
+        return
+
+    filename = title.replace(" ", "_") + ".pdf"
+    with open(path, "rb") as f:
+        await query.message.reply_document(document=f, filename=filename, caption=f"📄 {title}")
+
+
+# ======================
+# SMART MONITORING 4.0
+# ======================
+
+async def show_smart_dashboard(query):
+
+    msg = tenant().response_cache.get("statistik", get_today_malaysia(), build_smart_dashboard_message)
+    await outbox.edit(query, msg)
+
+
+def build_smart_dashboard_message():
+
+    # Satu salinan rekod untuk semua ringkasan
+    records = get_kehadiran_records(KEHADIRAN_CACHE_TTL)
+
+    # 🏆 Top 3 Bulanan
+    monthly_summary, monthly_top3 = generate_monthly_summary(records)
+
+    # 📊 Ranking Mingguan
+    weekly_summary, _ = generate_weekly_summary(records)
+
+    decline = detect_decline_two_weeks(records)
+    trend = calculate_1_month_trend(records)
+
+    msg = "📊 Statistik Kehadiran\n\n"
+
+    # 🏆 Top 3 Bulanan
+    msg += "🏆 Top 3 Kehadiran Bulanan\n"
+    for i, (k, p) in enumerate(monthly_top3):
+        medal = ["🥇","🥈","🥉"][i]
+        msg += f"{medal} {k} - {p:.1f}%\n"
+
+    # 📊 Ranking Mingguan (guna weekly)
+    msg += "\n" + weekly_summary + "\n\n"
+
+    if decline:
+        msg += "⚠️ Kehadiran merosot dalam tempoh 2 minggu:\n"
+        for k in decline:
+            msg += f"- {k}\n"
+        msg += "\n"
+
+    msg += "📈 Trend 1 Bulan (Tertinggi → Terendah)\n"
+    for k, v in trend:
+        msg += f"{k} - {v:.1f}%\n"
+
+    # 🏫 Rollup sekolah & tahun (dari kiub, tanpa imbas rekod)
+    cube = get_cube()
+    today = get_today_malaysia()
+    msg += "\n🏫 Kehadiran Sekolah\n"
+    msg += _cube_line("Hari ini", cube.stat("hari", today)) + "\n"
+    msg += _cube_line("Minggu ini", cube.stat("minggu", today)) + "\n"
+    msg += _cube_line("Bulan ini", cube.stat("bulan", today)) + "\n"
+    msg += "\n📚 Ikut Tahun (Bulan Ini)\n"
+    for y in year_levels(tenant().classes):
+        msg += _cube_line(year_label(y), cube.stat("bulan", today, "tahun", y)) + "\n"
+
+    return msg
+
+
+def generate_weekly_summary(records=None):
+
+    today = get_today_malaysia()
+    start = today - datetime.timedelta(days=(today.weekday() + 1) % 7)
+
+    if records is None:
+        records = get_kehadiran_records()
+    statistik = {}
+
+    for i in range(7):
+        day = start + datetime.timedelta(days=i)
+        tarikh = day.strftime("%d/%m/%Y")
+
+        daily = [r for r in records if r["Tarikh"] == tarikh]
+
+        for r in daily:
+            kelas = r["Kelas"]
+            try:
+                total = int(r["Jumlah"])
+            except:
+                continue
+
+            hadir = total - absent_count(r)
+
+            statistik.setdefault(kelas, {"hadir": 0, "total": 0})
+            statistik[kelas]["hadir"] += hadir
+            statistik[kelas]["total"] += total
+
+    if not statistik:
+        return "Tiada data minggu ini.", []
+
+    ranking = []
+    for kelas, data in statistik.items():
+        percent = (data["hadir"] / data["total"]) * 100
+        ranking.append((kelas, percent))
+
+    ranking.sort(key=lambda x: x[1], reverse=True)
+
+    msg = "📊 Ranking Mingguan\n"
+    for i, (k, p) in enumerate(ranking):
+        msg += f"{i+1}. {k} - {p:.1f}%\n"
+
+    return msg, ranking[:3]
+
+def generate_monthly_summary(records=None):
+
+    today = get_today_malaysia()
+    one_month_ago = today - datetime.timedelta(days=30)
+
+    if records is None:
+        records = get_kehadiran_records()
+    statistik = {}
+
+    for r in records:
+
+        try:
+            tarikh_obj = datetime.datetime.strptime(r["Tarikh"], "%d/%m/%Y").date()
+        except:
+            continue
+
+        if tarikh_obj < one_month_ago:
+            continue
+
+        kelas = r["Kelas"]
+
+        try:
+            total = int(r["Jumlah"])
+        except:
+            continue
+
+        if total <= 0:
+            continue
+
+        hadir = total - absent_count(r)
+
+        statistik.setdefault(kelas, {"hadir": 0, "total": 0})
+        statistik[kelas]["hadir"] += hadir
+        statistik[kelas]["total"] += total
+
+    if not statistik:
+        return "Tiada data bulan ini.", []
+
+    ranking = []
+    for kelas, data in statistik.items():
+        percent = (data["hadir"] / data["total"]) * 100
+        ranking.append((kelas, percent))
+
+    ranking.sort(key=lambda x: x[1], reverse=True)
+
+    msg = "📊 Ranking Bulanan\n"
+    for i, (k, p) in enumerate(ranking):
+        msg += f"{i+1}. {k} - {p:.1f}%\n"
+
+    return msg, ranking[:3]
+
+def calculate_1_month_trend(records=None):
+
+    today = get_today_malaysia()
+    one_month_ago = today - datetime.timedelta(days=30)
+
+    if records is None:
+        records = get_kehadiran_records()
+    statistik = {}
+
+    for r in records:
+
+        try:
+            tarikh_obj = datetime.datetime.strptime(r["Tarikh"], "%d/%m/%Y").date()
+        except:
+            continue
+
+        if tarikh_obj < one_month_ago:
+            continue
+
+        kelas = r["Kelas"]
+
+        try:
+            total = int(r["Jumlah"])
+        except:
+            continue
+
+        if total <= 0:
+            continue
+
+        hadir = total - absent_count(r)
+
+        statistik.setdefault(kelas, {"hadir": 0, "total": 0})
+        statistik[kelas]["hadir"] += hadir
+        statistik[kelas]["total"] += total
+
+    ranking = []
+    for kelas, data in statistik.items():
+        percent = (data["hadir"] / data["total"]) * 100
+        ranking.append((kelas, percent))
+
+    ranking.sort(key=lambda x: x[1], reverse=True)
+
+    return ranking
+
+
+def detect_decline_two_weeks(records=None):
+
+    if records is None:
+        records = get_kehadiran_records()
+    statistik = {}
+
+    for r in records:
+        kelas = r["Kelas"]
+
+        try:
+            total = int(r["Jumlah"])
+        except (ValueError, TypeError):
+            continue
+
+        if total <= 0:
+            continue
+
+        hadir = total - absent_count(r)
+
+        percent = (hadir / total) * 100
+
+        statistik.setdefault(kelas, []).append(percent)
+
+    decline = []
+    for kelas, values in statistik.items():
+        if len(values) >= 2 and values[-1] < values[-2]:
+            decline.append(kelas)
+
+    return decline
+# ======================
+# 🏫 KEHADIRAN IKUT TAHUN (SEKOLAH → TAHUN → KELAS)
+# ======================
+CUBE_GRAIN_LABELS = {"hari": "Hari Ini", "minggu": "Minggu Ini", "bulan": "Bulan Ini"}
+
+
+def _cube_period_label(grain, d):
+    start = period_start(grain, d)
+    if grain == "minggu":
+        return f"{start.strftime('%d/%m')} - {(start + datetime.timedelta(days=6)).strftime('%d/%m/%Y')}"
+    if grain == "bulan":
+        return start.strftime("%B %Y")
+    return start.strftime("%d/%m/%Y")
+
+
+def _cube_line(label, cell):
+    hadir, total, _ = cell
+    if not total:
+        return f"{label} - tiada rekod"
+    return f"{label} - {_rate(hadir, total):.1f}% ({hadir}/{total})"
+
+
+def build_cube_view(grain, level, member, today):
+    """Paparan drill-down dari kiub: sekolah → tahun → kelas. Pulangkan (mesej, papan kekunci)."""
+
+    t = tenant()
+    cube = get_cube()
+    title = f"{CUBE_GRAIN_LABELS[grain]} ({_cube_period_label(grain, today)})"
+    keyboard = []
+
+    if level == "sekolah":
+        msg = f"🏫 {t.nama} — {title}\n"
+        msg += _cube_line("Keseluruhan", cube.stat(grain, today)) + "\n\n📚 Ikut Tahun\n"
+        row = []
+        for y in year_levels(t.classes):
+            cell = cube.stat(grain, today, "tahun", y)
+            msg += _cube_line(year_label(y), cell) + "\n"
+            row.append(InlineKeyboardButton(year_label(y), callback_data=f"kiub|{grain}|tahun|{y}"))
+            if len(row) == 3:
+                keyboard.append(row)
+                row = []
+        if row:
+            keyboard.append(row)
+
+    elif level == "tahun":
+        msg = f"📚 {year_label(member)} — {title}\n"
+        msg += _cube_line("Keseluruhan", cube.stat(grain, today, "tahun", member)) + "\n"
+        msg += _cube_line("Sekolah", cube.stat(grain, today)) + "\n\n🏫 Ikut Kelas\n"
+        row = []
+        for k in t.classes:
+            if year_level(k) != member:
+                continue
+            msg += _cube_line(k, cube.stat(grain, today, "kelas", k)) + "\n"
+            row.append(InlineKeyboardButton(k, callback_data=f"kiub|{grain}|kelas|{k}"))
+            if len(row) == 3:
+                keyboard.append(row)
+                row = []
+        if row:
+            keyboard.append(row)
+        keyboard.append([InlineKeyboardButton("⬅️ Sekolah", callback_data=f"kiub|{grain}|sekolah|{CUBE_SCHOOL}")])
+
+    else:
+        y = year_level(member)
+        msg = f"🏫 {member} — {title}\n"
+        msg += _cube_line("Kelas", cube.stat(grain, today, "kelas", member)) + "\n"
+        msg += _cube_line(year_label(y), cube.stat(grain, today, "tahun", y)) + "\n"
+        msg += _cube_line("Sekolah", cube.stat(grain, today)) + "\n\n📈 Tempoh\n"
+        for g in CUBE_GRAINS:
+            msg += _cube_line(CUBE_GRAIN_LABELS[g], cube.stat(g, today, "kelas", member)) + "\n"
+        keyboard.append([
+            InlineKeyboardButton(f"⬅️ {year_label(y)}", callback_data=f"kiub|{grain}|tahun|{y}"),
+            InlineKeyboardButton("🔍 Semak Rekod", callback_data=f"semak_kelas|{member}")
+        ])
+
+    # Tukar butiran tempoh pada aras yang sama
+    keyboard.append([
+        InlineKeyboardButton(("• " if g == grain else "") + CUBE_GRAIN_LABELS[g], callback_data=f"kiub|{g}|{level}|{member}")
+        for g in CUBE_GRAINS
+    ])
+
+    return msg, InlineKeyboardMarkup(keyboard)
+
+
+async def show_cube_view(query, data):
+    parts = data.split("|")
+    if len(parts) == 4 and parts[1] in CUBE_GRAINS:
+        _, grain, level, member = parts
+    else:
+        grain, level, member = "hari", "sekolah", CUBE_SCHOOL
+
+    today = get_today_malaysia()
+    msg, markup = tenant().response_cache.get(
+        "kiub", (grain, level, member, today), lambda: build_cube_view(grain, level, member, today)
+    )
+    await outbox.edit(query, msg, reply_markup=markup)
+
+
+# ======================
+# MENU BUTTON HANDLER
+# ======================
+async def handle_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.text.strip() == "🏠 Menu Utama":
+        user_state.pop(update.message.from_user.id, None)
+        await start(update, context)
+
+    elif update.message.text.strip() == "📊 Dashboard":
+        await outbox.reply(
+            update.message,
+            "📊 Klik link di bawah untuk buka dashboard:\n\nhttps://dashboardkehadiran.vercel.app/"
+        )
+
+async def auto_send_friday_report(context: ContextTypes.DEFAULT_TYPE):
+
+    group_id = tenant().group_id
+    if group_id is None:
+        return
+
+    records = get_kehadiran_snapshot()
+    summary, top3 = generate_weekly_summary(records)
+    decline = detect_decline_two_weeks(records)
+
+    msg = "📡 LAPORAN KEHADIRAN MINGGUAN\n\n"
+
+    if top3:
+        msg += "🏆 Top 3 Mingguan\n"
+        for i, (k, p) in enumerate(top3):
+            medal = ["🥇","🥈","🥉"][i]
+            msg += f"{medal} {k} - {p:.1f}%\n"
+        msg += "\n"
+
+    msg += summary
+
+    if decline:
+        msg += "\n\n⬇️ Kehadiran Menurun:\n"
+        for k in decline:
+            msg += f"⚠️ {k}\n"
+
+    await outbox.send(context.bot, group_id, msg)
+
+# ======================
+# 🔔 AUTO REMINDER 9:45 PAGI
+# ======================
+
+async def auto_reminder_unupdated_classes(context: ContextTypes.DEFAULT_TYPE):
+
+    t = tenant()
+    if t.group_id is None:
+        return
+
+    today = get_today_malaysia()
+    tarikh = today.strftime("%d/%m/%Y")
+
+    records = get_kehadiran_snapshot()
+
+    recorded = set()
+    for r in records:
+        if r["Tarikh"] == tarikh:
+            recorded.add(r["Kelas"].strip().lower())
+
+    belum_update = [
+        k for k in t.classes
+        if k.strip().lower() not in recorded
+    ]
+
+    if not belum_update:
+        # Semua dah update, tak perlu hantar apa-apa
         return
 
-    # ---------- PILIH HARI ----------
-    if data.startswith("cal_day|"):
-        _, year, month, day = data.split("|")
+    msg = (
+        "⏰ PERINGATAN PENGISIAN KEHADIRAN KELAS \n\n"
+        f"📅 {tarikh}\n\n"
+        "Kelas berikut masih belum mengisi kehadiran:\n\n"
+    )
 
-        target_date = f"{int(day):02d}/{int(month):02d}/{year}"
-        state = user_state[user_id]
-        kelas = state["semak_kelas"]
+    for i, kelas in enumerate(belum_update, 1):
+        msg += f"{i}. {kelas}\n"
 
-        await show_record_for_date(query, kelas, target_date)
+    msg += "\n⚠️ Mohon guru semasa ambil tindakan segera.\n\n"
+    msg += "\n Mesej ini dijana secara automatik.\n\n"
+    msg += f"📊 Sistem Tracker Kehadiran {t.nama}"
+
+    await outbox.send(context.bot, t.group_id, msg)
+
+async def send_announcement(context: ContextTypes.DEFAULT_TYPE):
+
+    group_id = tenant().group_id
+    if group_id is None:
         return
 
+    await outbox.send(context.bot, group_id, context.job.data["mesej"])
+
+
+JOB_TYPES = {
+    "laporan_mingguan": auto_send_friday_report,
+    "peringatan": auto_reminder_unupdated_classes,
+    "pengumuman": send_announcement,
+}
+
 
 # ======================
-# SHOW STUDENT BUTTONS
+# 📊 SNAPSHOT DASHBOARD (STATIK)
 # ======================
-async def show_student_buttons(query, user_id):
+SNAPSHOT_VERSION = 1
 
-    state = user_state[user_id]
 
-    msg = format_attendance(
-        state["kelas"],
-        state["tarikh"],
-        state["hari"],
-        len(state["students"]),
-        state["absent"]
-    )
+def _rate(hadir, total):
+    return round((hadir / total) * 100, 1) if total else 0.0
 
-    keyboard = []
-    for n in state["students"]:
-        label = f"🔴 {n}" if n in state["absent"] else f"🟢 {n}"
-        keyboard.append([InlineKeyboardButton(label, callback_data=f"murid|{n}")])
 
-    keyboard.append([
-        InlineKeyboardButton("💾 Simpan", callback_data="simpan"),
-        InlineKeyboardButton("♻️ Reset", callback_data="reset"),
-        InlineKeyboardButton("✅ Semua Hadir", callback_data="semua_hadir")
-    ])
+def build_dashboard_snapshot(records, today):
+    """Agregat ringkas untuk dashboard: hari ini, kadar kelas, trend 7/30 hari dan kelas belum isi."""
+
+    tarikh_today = today.strftime("%d/%m/%Y")
+    window_start = today - datetime.timedelta(days=29)
+
+    harian = {}
+    kelas_stat = {}
+    recorded_today = set()
+
+    for r in records:
+        try:
+            tarikh_obj = datetime.datetime.strptime(r["Tarikh"], "%d/%m/%Y").date()
+            total = int(r["Jumlah"])
+        except (ValueError, TypeError, KeyError):
+            continue
+
+        if total <= 0 or tarikh_obj < window_start or tarikh_obj > today:
+            continue
+
+        hadir = total - absent_count(r)
+        kelas = r["Kelas"]
+
+        day = harian.setdefault(tarikh_obj, {"hadir": 0, "total": 0})
+        day["hadir"] += hadir
+        day["total"] += total
+
+        stat = kelas_stat.setdefault(kelas, {"hadir": 0, "total": 0})
+        stat["hadir"] += hadir
+        stat["total"] += total
+
+        if r["Tarikh"] == tarikh_today:
+            recorded_today.add(kelas.strip().lower())
+
+    def trend(days):
+        points = []
+        for i in range(days - 1, -1, -1):
+            day = today - datetime.timedelta(days=i)
+            if day in harian:
+                points.append({
+                    "tarikh": day.strftime("%d/%m/%Y"),
+                    "peratus": _rate(harian[day]["hadir"], harian[day]["total"])
+                })
+        return points
+
+    today_stat = harian.get(today, {"hadir": 0, "total": 0})
+
+    kelas_rates = [
+        {"kelas": k, "hadir": v["hadir"], "total": v["total"], "peratus": _rate(v["hadir"], v["total"])}
+        for k, v in kelas_stat.items()
+    ]
+    kelas_rates.sort(key=lambda x: x["peratus"], reverse=True)
+
+    return {
+        "version": SNAPSHOT_VERSION,
+        "generated_at": datetime.datetime.now(pytz.timezone("Asia/Kuala_Lumpur")).isoformat(timespec="seconds"),
+        "tarikh": tarikh_today,
+        "hari_ini": {
+            "hadir": today_stat["hadir"],
+            "total": today_stat["total"],
+            "peratus": _rate(today_stat["hadir"], today_stat["total"])
+        },
+        "kelas": kelas_rates,
+        "trend_7": trend(7),
+        "trend_30": trend(30),
+        "sekolah": tenant().nama,
+        "belum_isi": [k for k in tenant().classes if k.strip().lower() not in recorded_today],
+        "semua_kelas": tenant().classes
+    }
+
+
+def write_dashboard_snapshot(path=None):
+    path = path or tenant().snapshot_path
+    snapshot = build_dashboard_snapshot(get_kehadiran_snapshot(max_age=0), get_today_malaysia())
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+    return snapshot
+
+
+def publish_dashboard_snapshot(path=None):
+    """Jalankan DASHBOARD_PUBLISH_CMD supaya snapshot sampai ke hos statik dashboard."""
+
+    if not DASHBOARD_PUBLISH_CMD:
+        return
+    t = tenant()
+    path = path or t.snapshot_path
+    cmd = [part.replace("{path}", path).replace("{sekolah}", t.id) for part in shlex.split(DASHBOARD_PUBLISH_CMD)]
+    subprocess.run(cmd, check=True, timeout=DASHBOARD_PUBLISH_TIMEOUT, capture_output=True)
+
+
+async def dashboard_snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    t = enter_job_tenant(context)
+    try:
+        async with profile_section("job:dashboard_snapshot"):
+            # Bacaan Sheets (max_age=0) & penulisan fail di luar event loop: dijalankan semasa puncak pagi
+            await asyncio.to_thread(write_dashboard_snapshot)
+    except Exception:
+        logger.exception("Gagal menjana snapshot dashboard (%s)", t.id)
+        return
+
+    try:
+        await asyncio.to_thread(publish_dashboard_snapshot)
+    except Exception:
+        logger.exception("Gagal menerbitkan snapshot dashboard (%s)", t.id)
+
+
+def schedule_dashboard_snapshot(context):
+    # Debounce: simpanan berturut-turut dalam tempoh yang sama hanya menjana satu snapshot
+    t = tenant()
+    name = t.job_name("dashboard_snapshot")
+    if context.job_queue.get_jobs_by_name(name):
+        return
 
-    await query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(keyboard))
+    context.job_queue.run_once(
+        dashboard_snapshot_job,
+        when=DASHBOARD_SNAPSHOT_DELAY,
+        name=name,
+        data={"sekolah": t.id}
+    )
 
 
 # ======================
-# SHOW CALENDAR
+# 🗄 ARKIB & PEMADATAN SHEET KEHADIRAN
 # ======================
-async def show_calendar(query, user_id):
+ARCHIVE_SUMMARY_FILE = "ringkasan.json"
 
-    state = user_state[user_id]
-    year = state["calendar_year"]
-    month = state["calendar_month"]
 
-    first_day = datetime.date(year, month, 1)
-    start_weekday = first_day.weekday()
-    days_in_month = (datetime.date(year + (month // 12), ((month % 12) + 1), 1) - datetime.timedelta(days=1)).day
+def _archive_partition_path(tarikh_obj):
+    return os.path.join(tenant().archive_dir, str(tarikh_obj.year), tarikh_obj.strftime("%Y-%m") + ".jsonl.gz")
 
-    keyboard = []
 
-    keyboard.append([
-        InlineKeyboardButton("⬅️", callback_data=f"cal_nav|{year}|{month-1 if month>1 else 12}"),
-        InlineKeyboardButton(f"{first_day.strftime('%B')} {year}", callback_data="noop"),
-        InlineKeyboardButton("➡️", callback_data=f"cal_nav|{year}|{month+1 if month<12 else 1}")
-    ])
+def _read_partition(path):
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
 
-    weekdays = ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
-    keyboard.append([InlineKeyboardButton(d, callback_data="noop") for d in weekdays])
 
-    row = []
-    for _ in range(start_weekday):
-        row.append(InlineKeyboardButton(" ", callback_data="noop"))
+def _write_partition(path, records):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
 
-    today = get_today_malaysia()
 
+def _list_partitions(start=None, end=None):
+    """Senarai fail partition (ikut kronologi) yang bertindih dengan julat tarikh."""
 
-    for day in range(1, days_in_month + 1):
+    archive_dir = tenant().archive_dir
+    if not os.path.isdir(archive_dir):
+        return []
 
-        label = str(day)
+    paths = []
+    for year in sorted(os.listdir(archive_dir)):
+        year_dir = os.path.join(archive_dir, year)
+        if not os.path.isdir(year_dir):
+            continue
+        for name in sorted(os.listdir(year_dir)):
+            if not name.endswith(".jsonl.gz"):
+                continue
+            try:
+                month_start = datetime.datetime.strptime(name[:7], "%Y-%m").date()
+            except ValueError:
+                continue
+            month_end = (month_start + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+            if start and month_end < start:
+                continue
+            if end and month_start > end:
+                continue
+            paths.append(os.path.join(year_dir, name))
+    return paths
 
-        if (
-            day == today.day
-            and month == today.month
-            and year == today.year
-        ):
-            label = f"{day}🟢"
 
-        row.append(
-            InlineKeyboardButton(
-                label,
-                callback_data=f"cal_day|{year}|{month}|{day}"
-            )
-        )
+def load_archive_summary():
+    path = os.path.join(tenant().archive_dir, ARCHIVE_SUMMARY_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("harian", {})
 
-        if len(row) == 7:
-            keyboard.append(row)
-            row = []
 
-    if row:
-        while len(row) < 7:
-            row.append(InlineKeyboardButton(" ", callback_data="noop"))
-        keyboard.append(row)
+def _write_archive_summary(harian):
+    archive_dir = tenant().archive_dir
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, ARCHIVE_SUMMARY_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "harian": harian}, f, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp_path, path)
 
-    await query.edit_message_text("🗓 Pilih tarikh:", reply_markup=InlineKeyboardMarkup(keyboard))
 
+def _summarize_records(records):
+    """Ringkasan pra-agregat {YYYY-MM-DD: {kelas: [hadir, total]}}."""
 
-# ======================
-# SHOW RECORD FOR DATE
-# ======================
-async def show_record_for_date(query, kelas, target_date):
+    harian = {}
+    for r in records:
+        tarikh_obj = parse_tarikh(r.get("Tarikh"))
+        try:
+            total = int(r["Jumlah"])
+        except (ValueError, TypeError, KeyError):
+            continue
+        if tarikh_obj is None or total <= 0:
+            continue
+
+        hadir = total - absent_count(r)
+        day = harian.setdefault(tarikh_obj.isoformat(), {})
+        stat = day.setdefault(r["Kelas"], [0, 0])
+        stat[0] += hadir
+        stat[1] += total
+    return harian
+
+
+def _delete_sheet_rows(sheet, row_numbers):
+    """Padam baris mengikut julat berturutan, dari bawah ke atas supaya indeks tidak beralih."""
 
+    runs = []
+    for n in sorted(row_numbers):
+        if runs and runs[-1][1] == n - 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+
+    for start, end in reversed(runs):
+        sheet.delete_rows(start, end)
+
+
+def archive_cutoff_limit(today=None):
+    """Tarikh `cutoff` terlewat yang dibenarkan: awal penggal semasa, atau hari ini semasa cuti antara penggal."""
+
+    today = today or get_today_malaysia()
+    for _, start, end in get_terms(today.year):
+        if start <= today <= end:
+            return start
+    return today
+
+
+def archive_before(cutoff, to_sheet=ARCHIVE_SHEETS, dry_run=False):
+    """Pindahkan rekod sebelum `cutoff` (date) dari sheet Kehadiran ke arkib tempatan."""
+
+    # Rekod tempoh terbuka mesti kekal dalam sheet: kalendar, semak & pengesanan overwrite hanya membacanya
+    limit = archive_cutoff_limit()
+    if cutoff > limit:
+        raise ValueError(f"Tarikh arkib mesti tidak melebihi {limit.strftime('%d/%m/%Y')} (awal penggal semasa)")
+
+    sheet_kehadiran = tenant().sheet_kehadiran
     records = sheet_kehadiran.get_all_records()
 
-    for r in records:
-        if r["Kelas"] == kelas and r["Tarikh"] == target_date:
-            msg = format_attendance(
-                kelas,
-                r["Tarikh"],
-                r["Hari"],
-                r["Jumlah"],
-                r["Tidak Hadir"].split(", ") if r["Tidak Hadir"] else []
-            )
+    moved = {}
+    row_numbers = []
+    for idx, r in enumerate(records, start=2):
+        tarikh_obj = parse_tarikh(r.get("Tarikh"))
+        if tarikh_obj is None or tarikh_obj >= cutoff:
+            continue
+        moved.setdefault(_archive_partition_path(tarikh_obj), []).append(r)
+        row_numbers.append(idx)
+
+    if dry_run or not row_numbers:
+        return len(row_numbers)
+
+    # 1) Tulis partition (idempotent: rekod sama (Kelas, Tarikh) diganti yang terbaru)
+    harian = load_archive_summary()
+    for path, new_records in moved.items():
+        merged = {(r["Kelas"], r["Tarikh"]): r for r in _read_partition(path)}
+        for r in new_records:
+            merged[(r["Kelas"], r["Tarikh"])] = r
+
+        partition = sorted(merged.values(), key=lambda r: (parse_tarikh(r["Tarikh"]), r["Kelas"]))
+        _write_partition(path, partition)
+        harian.update(_summarize_records(partition))
+
+    _write_archive_summary(harian)
+
+    # 2) Worksheet arkib tahunan (pilihan)
+    if to_sheet:
+        by_year = {}
+        for new_records in moved.values():
+            for r in new_records:
+                by_year.setdefault(parse_tarikh(r["Tarikh"]).year, []).append(r)
+
+        header = list(records[0].keys())
+        spreadsheet = sheet_kehadiran.spreadsheet
+        for year, year_records in sorted(by_year.items()):
+            title = f"Arkib {year}"
             try:
-                await query.edit_message_text(msg)
-            except Exception:
-                pass
-            return
+                ws = spreadsheet.worksheet(title)
+            except gspread.exceptions.WorksheetNotFound:
+                ws = spreadsheet.add_worksheet(title=title, rows=1, cols=len(header))
+                ws.update(range_name="A1", values=[header])
+            ws.append_rows([[r.get(h, "") for h in header] for r in year_records])
 
-    keyboard = [
-        [InlineKeyboardButton("📅 Hari Ini", callback_data="semak_tarikh|today")],
-        [InlineKeyboardButton("📆 Semalam", callback_data="semak_tarikh|yesterday")],
-        [InlineKeyboardButton("🗓 Pilih Tarikh", callback_data="semak_tarikh|calendar")],
-        [InlineKeyboardButton("📄 Export PDF Mingguan", callback_data="export_pdf_weekly")]
-    ]
+    # 3) Barulah padam dari sheet utama
+    _delete_sheet_rows(sheet_kehadiran, row_numbers)
 
-    try:
-        await query.edit_message_text(
-            "❌ Tiada rekod untuk tarikh ini.\n\nPilih tarikh lain:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    except Exception:
-        pass
+    return len(row_numbers)
+
+
+def iter_attendance(start=None, end=None, hot_records=None):
+    """Rekod kehadiran dari arkib + sheet utama bagi julat tarikh (inklusif), ikut kronologi."""
+
+    if hot_records is None:
+        hot_records = get_kehadiran_records()
+
+    def in_range(r):
+        tarikh_obj = parse_tarikh(r.get("Tarikh"))
+        if tarikh_obj is None:
+            return False
+        return (start is None or tarikh_obj >= start) and (end is None or tarikh_obj <= end)
+
+    hot_keys = {(r["Kelas"], r["Tarikh"]) for r in hot_records}
+
+    for path in _list_partitions(start, end):
+        for r in _read_partition(path):
+            # Sheet utama menang jika rekod wujud di kedua-dua tempat
+            if (r["Kelas"], r["Tarikh"]) not in hot_keys and in_range(r):
+                yield r
+
+    for r in hot_records:
+        if in_range(r):
+            yield r
 
 
 # ======================
-# EXPORT PDF MINGGUAN
+# 📥 IMPORT PUKAL (BACKFILL SEJARAH)
 # ======================
-async def export_pdf_weekly(query):
+IMPORT_BATCH_SIZE = 500
+IMPORT_MIN_INTERVAL = 1.2  # saat antara panggilan tulis (kuota Sheets ~60 tulis/minit)
+
+
+def _iter_json_array(f, chunk_size=65536):
+    """Strim objek dari fail JSON berbentuk array tanpa memuatkan keseluruhan fail."""
+
+    decoder = json.JSONDecoder()
+    buf = ""
+    started = False
+
+    while True:
+        chunk = f.read(chunk_size)
+        buf += chunk
+        pos = 0
+
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if not started and pos < len(buf):
+                if buf[pos] != "[":
+                    raise ValueError("Fail JSON mesti berbentuk array rekod")
+                started = True
+                pos += 1
+                continue
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break
+            yield obj
+            pos = end
+
+        buf = buf[pos:]
+        if not chunk:
+            if buf.strip():
+                raise ValueError("Fail JSON tidak lengkap")
+            return
 
-    today = get_today_malaysia()
-    start = today - datetime.timedelta(days=(today.weekday() + 1) % 7)
 
-    records = sheet_kehadiran.get_all_records()
-    styles = getSampleStyleSheet()
+def read_import_rows(path):
+    """Baca CSV / JSON Lines / JSON array secara strim, satu rekod pada satu masa."""
 
-    file_path = "/tmp/Rekod_Kehadiran_Mingguan.pdf"
-    doc = SimpleDocTemplate(file_path)
-    story = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(f)
+        elif path.lower().endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif path.lower().endswith(".json"):
+            yield from _iter_json_array(f)
+        else:
+            raise ValueError(f"Format fail tidak disokong: {path}")
 
-    story.append(Paragraph("Rekod Kehadiran Murid SK Labu Besar", styles["Title"]))
-    story.append(Paragraph("Laporan Mingguan", styles["Heading2"]))
-    story.append(Spacer(1, 12))
 
-    ada_data = False
+def validate_import_rows(rows, roster):
+    """Hasilkan (baris_sheet, None) bagi rekod sah atau (rekod_asal, sebab) bagi yang ditolak."""
 
-    for i in range(7):
-        day = start + datetime.timedelta(days=i)
-        tarikh = day.strftime("%d/%m/%Y")
-        hari = day.strftime("%A")
+    class_lookup = {k.strip().lower(): k for k in tenant().classes}
 
-        daily = [r for r in records if r["Tarikh"] == tarikh]
-        if not daily:
+    for r in rows:
+        kelas = class_lookup.get(str(r.get("Kelas", "")).strip().lower())
+        if not kelas:
+            yield r, f"Kelas tidak sah: {r.get('Kelas')!r}"
             continue
 
-        ada_data = True
+        tarikh_obj = parse_tarikh(str(r.get("Tarikh", "")).strip())
+        if tarikh_obj is None:
+            yield r, f"Tarikh tidak sah: {r.get('Tarikh')!r}"
+            continue
 
-        story.append(Paragraph(f"{hari}  |  {tarikh}", styles["Heading2"]))
-        story.append(Spacer(1, 8))
+        raw_absent = r.get("Tidak Hadir") or []
+        if isinstance(raw_absent, str):
+            raw_absent = [n for n in (x.strip() for x in raw_absent.split(",")) if n]
 
-        for r in sorted(daily, key=lambda x: x["Kelas"]):
-            absent = r["Tidak Hadir"].split(", ") if r["Tidak Hadir"] else []
-            hadir = int(r["Jumlah"]) - len(absent)
+        absent = []
+        unknown = []
+        for n in raw_absent:
+            sid = roster.lookup(kelas, n)
+            if sid is None:
+                unknown.append(n)
+            else:
+                absent.append(sid)
+        if unknown:
+            yield r, f"Murid tiada dalam senarai {kelas}: {', '.join(map(str, unknown))}"
+            continue
 
-            story.append(Paragraph(f"<b>Kelas : {r['Kelas']}</b>", styles["Heading3"]))
-            story.append(Paragraph(f"Hari : {hari}", styles["Normal"]))
-            story.append(Paragraph(f"Tarikh : {tarikh}", styles["Normal"]))
-            story.append(Spacer(1, 4))
+        try:
+            # Tanpa Jumlah, guna bilangan murid kelas dalam senarai semasa
+            total = int(r.get("Jumlah") or len(roster.by_class.get(kelas, [])))
+        except (ValueError, TypeError):
+            yield r, f"Jumlah tidak sah: {r.get('Jumlah')!r}"
+            continue
+        if total <= 0 or len(absent) > total:
+            yield r, f"Jumlah tidak sah: {total} (tidak hadir {len(absent)})"
+            continue
 
-            story.append(Paragraph(f"Kehadiran : {hadir} / {r['Jumlah']}", styles["Normal"]))
+        tarikh = tarikh_obj.strftime("%d/%m/%Y")
+        hari = r.get("Hari") or tarikh_obj.strftime("%A")
+        yield build_attendance_row(kelas, tarikh, hari, total, absent, roster), None
 
-            if absent:
-                story.append(Paragraph("Tidak Hadir:", styles["Normal"]))
-                for idx, name in enumerate(absent, 1):
-                    story.append(Paragraph(f"{idx}. {name}", styles["Normal"]))
-            else:
-                story.append(Paragraph("Semua murid hadir", styles["Normal"]))
 
-            story.append(Spacer(1, 12))
+def dedupe_import_rows(results, existing_keys):
+    """Tolak (Kelas, Tarikh) yang sudah wujud dalam sheet/arkib atau berulang dalam fail."""
 
-    if not ada_data:
-        story.append(Paragraph(
-            "Tiada rekod kehadiran direkodkan setakat ini untuk minggu ini.",
-        styles["Normal"]
-    ))
-        story.append(Spacer(1, 12))
+    seen = set(existing_keys)
+    for row, reason in results:
+        if reason is None:
+            key = (row[2], row[0])
+            if key in seen:
+                yield row, f"Duplikasi {row[2]} {row[0]}"
+                continue
+            seen.add(key)
+        yield row, reason
 
-    # 📊 Bar Chart Ranking Mingguan
-    summary, top3 = generate_weekly_summary()
 
-    if top3:
+def _append_rows_with_retry(rows, retries=5):
+    delay = IMPORT_MIN_INTERVAL
+    for attempt in range(retries):
+        try:
+            tenant().sheet_kehadiran.append_rows(rows)
+            return
+        except gspread.exceptions.APIError as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if status not in (429, 500, 503) or attempt == retries - 1:
+                raise
+            logger.warning("Kuota Sheets (%s), cuba semula dalam %.1fs", status, delay * 2)
+            delay *= 2
+            time_module.sleep(delay)
 
-        drawing = Drawing(400, 200)
-        chart = VerticalBarChart()
-        chart.x = 50
-        chart.y = 50
-        chart.height = 125
-        chart.width = 300
 
-        chart.data = [[p for _, p in top3]]
-        chart.categoryAxis.categoryNames = [k for k, _ in top3]
-        chart.valueAxis.valueMin = 0
-        chart.valueAxis.valueMax = 100
+def bulk_import(paths, batch_size=IMPORT_BATCH_SIZE, dry_run=False, rejected_path=None):
+    """Import pukal: strim → sahkan → nyahduplikasi → tulis `append_rows` berkelompok."""
 
-        drawing.add(chart)
-        story.append(Spacer(1, 20))
-        story.append(Paragraph("Graf Top 3 Kehadiran Mingguan", styles["Heading2"]))
-        story.append(drawing)
-        
-    doc.build(story)
+    started = time_module.monotonic()
+    roster = get_roster_fresh()
+    existing_keys = {(r["Kelas"], r["Tarikh"]) for r in iter_attendance()}
 
-    await query.message.reply_document(
-        document=open(file_path, "rb"),
-        filename="Rekod_Kehadiran_Mingguan.pdf",
-        caption="📄 Rekod Kehadiran Mingguan"
-    )
+    stats = {"dibaca": 0, "diterima": 0, "ditolak": 0, "batch": 0}
+
+    def rows():
+        for path in paths:
+            for r in read_import_rows(path):
+                stats["dibaca"] += 1
+                yield r
+
+    rejected_file = open(rejected_path, "w", encoding="utf-8", newline="") if rejected_path else None
+    rejected_writer = csv.writer(rejected_file) if rejected_file else None
+    if rejected_writer:
+        rejected_writer.writerow(["Sebab", "Rekod"])
+
+    batch = []
+    last_write = 0.0
+
+    def flush():
+        nonlocal batch, last_write
+        if not batch:
+            return
+        if not dry_run:
+            wait = IMPORT_MIN_INTERVAL - (time_module.monotonic() - last_write)
+            if wait > 0:
+                time_module.sleep(wait)
+            _append_rows_with_retry(batch)
+            last_write = time_module.monotonic()
+        stats["batch"] += 1
+        batch = []
+
+    try:
+        for row, reason in dedupe_import_rows(validate_import_rows(rows(), roster), existing_keys):
+            if reason:
+                stats["ditolak"] += 1
+                if rejected_writer:
+                    rejected_writer.writerow([reason, json.dumps(row, ensure_ascii=False, default=str)])
+                continue
+
+            stats["diterima"] += 1
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        if rejected_file:
+            rejected_file.close()
+
+    stats["saat"] = round(time_module.monotonic() - started, 2)
+    stats["rekod_sesaat"] = round(stats["dibaca"] / stats["saat"], 1) if stats["saat"] else 0.0
+    return stats
+
+
+# ======================
+# 📤 EKSPORT JULAT TARIKH (CSV / JSON LINES)
+# ======================
+EXPORT_FIELDS = ["Tarikh", "Hari", "Kelas", "Hadir", "Jumlah", "Tidak Hadir", "ID Tidak Hadir"]
+EXPORT_FIELDS_PER_MURID = ["Tarikh", "Hari", "Kelas", "ID Murid", "Nama Murid"]
+
+
+def iter_export_rows(start, end, classes=None, per_murid=False):
+    """Strim baris eksport dari arkib + sheet utama (satu bacaan sheet sahaja)."""
+
+    wanted = {k.strip().lower() for k in classes} if classes else None
+    roster = get_roster()
 
-# ======================
-# SMART MONITORING 4.0
-# ======================
+    for r in iter_attendance(start, end):
+        if wanted and r["Kelas"].strip().lower() not in wanted:
+            continue
 
-async def show_smart_dashboard(query):
+        ids = absent_ids(r)
+        absent = absent_names(r, roster)
 
-    # 🏆 Top 3 Bulanan
-    monthly_summary, monthly_top3 = generate_monthly_summary()
+        if per_murid:
+            for i, name in enumerate(absent):
+                yield {
+                    "Tarikh": r["Tarikh"], "Hari": r["Hari"], "Kelas": r["Kelas"],
+                    "ID Murid": ids[i] if ids else roster.lookup(r["Kelas"], name) or "",
+                    "Nama Murid": name
+                }
+            continue
 
-    # 📊 Ranking Mingguan
-    weekly_summary, _ = generate_weekly_summary()
+        try:
+            jumlah = int(r["Jumlah"])
+        except (ValueError, TypeError):
+            continue
 
-    decline = detect_decline_two_weeks()
-    trend = calculate_1_month_trend()
+        yield {
+            "Tarikh": r["Tarikh"],
+            "Hari": r["Hari"],
+            "Kelas": r["Kelas"],
+            "Hadir": jumlah - len(absent),
+            "Jumlah": jumlah,
+            "Tidak Hadir": ", ".join(absent),
+            "ID Tidak Hadir": encode_absent_ids(ids) if ids else ""
+        }
 
-    msg = "📊 Statistik Kehadiran\n\n"
 
-    # 🏆 Top 3 Bulanan
-    msg += "🏆 Top 3 Kehadiran Bulanan\n"
-    for i, (k, p) in enumerate(monthly_top3):
-        medal = ["🥇","🥈","🥉"][i]
-        msg += f"{medal} {k} - {p:.1f}%\n"
+def write_export(out, rows, fmt="csv", per_murid=False):
+    """Tulis baris ke fail terbuka satu demi satu; pulangkan bilangan baris."""
+
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS_PER_MURID if per_murid else EXPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    elif fmt == "jsonl":
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    else:
+        raise ValueError(f"Format eksport tidak disokong: {fmt}")
+    return count
 
-    # 📊 Ranking Mingguan (guna weekly)
-    msg += "\n" + weekly_summary + "\n\n"
 
-    if decline:
-        msg += "⚠️ Kehadiran merosot dalam tempoh 2 minggu:\n"
-        for k in decline:
-            msg += f"- {k}\n"
-        msg += "\n"
+async def eksport_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/eksport DD/MM/YYYY DD/MM/YYYY [csv|jsonl] [murid] [Kelas A, Kelas B]"""
 
-    msg += "📈 Trend 1 Bulan (Tertinggi → Terendah)\n"
-    for k, v in trend:
-        msg += f"{k} - {v:.1f}%\n"
+    # Data bernama murid tidak hadir (berbilang tahun): pentadbir sahaja
+    if not is_admin(update.effective_user.id):
+        return
 
-    await query.edit_message_text(msg)
+    if not await ensure_ready():
+        await outbox.reply(update.message, "⏳ Sistem sedang dimulakan. Sila cuba sebentar lagi.")
+        return
 
+    args = context.args or []
+    start = parse_tarikh(args[0]) if len(args) > 0 else None
+    end = parse_tarikh(args[1]) if len(args) > 1 else None
 
-def generate_weekly_summary():
+    if not start or not end or start > end:
+        await outbox.reply(
+            update.message,
+            "📤 Cara guna:\n"
+            "/eksport DD/MM/YYYY DD/MM/YYYY [csv|jsonl] [murid] [Kelas, Kelas]\n\n"
+            "Contoh:\n/eksport 01/01/2026 31/03/2026 csv 1 Amber, 2 Amber"
+        )
+        return
 
-    today = get_today_malaysia()
-    start = today - datetime.timedelta(days=(today.weekday() + 1) % 7)
+    fmt = "csv"
+    per_murid = False
+    rest = args[2:]
+    while rest and rest[0].lower() in ("csv", "jsonl", "murid"):
+        if rest[0].lower() == "murid":
+            per_murid = True
+        else:
+            fmt = rest[0].lower()
+        rest = rest[1:]
 
-    records = sheet_kehadiran.get_all_records()
-    statistik = {}
+    classes = [k.strip() for k in " ".join(rest).split(",") if k.strip()] or None
 
-    for i in range(7):
-        day = start + datetime.timedelta(days=i)
-        tarikh = day.strftime("%d/%m/%Y")
+    filename = f"Kehadiran_{start.strftime('%Y%m%d')}_{end.strftime('%Y%m%d')}.{fmt}"
 
-        daily = [r for r in records if r["Tarikh"] == tarikh]
+    def export_to_file():
+        # Fail sementara unik: eksport serentak (pengguna / sekolah lain) tidak saling menulis ganti
+        fd, path = tempfile.mkstemp(prefix="kehadiran_eksport_", suffix=f".{fmt}")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                return path, write_export(f, iter_export_rows(start, end, classes, per_murid), fmt, per_murid)
+        except Exception:
+            os.remove(path)
+            raise
 
-        for r in daily:
-            kelas = r["Kelas"]
-            try:
-                total = int(r["Jumlah"])
-            except:
-                continue
+    # Julat berbilang tahun membaca arkib: di luar event loop supaya guru lain tidak tertunggu
+    file_path, count = await asyncio.to_thread(export_to_file)
+    try:
+        with open(file_path, "rb") as f:
+            await update.message.reply_document(
+                document=f,
+                filename=filename,
+                caption=f"📤 {count} baris | {start.strftime('%d/%m/%Y')} - {end.strftime('%d/%m/%Y')}"
+            )
+    finally:
+        os.remove(file_path)
 
-            absent = r["Tidak Hadir"].split(", ") if r["Tidak Hadir"] else []
-            hadir = total - len(absent)
 
-            statistik.setdefault(kelas, {"hadir": 0, "total": 0})
-            statistik[kelas]["hadir"] += hadir
-            statistik[kelas]["total"] += total
+# ======================
+# 🗓 JADUAL TUGASAN (REGISTRY)
+# ======================
+# Jenis: laporan_mingguan | peringatan | pengumuman
+# Harian: "masa" HH:MM + "hari" (nombor hari job_queue, atau nama: Ahad, Isnin, ... Sabtu)
+# Sekali: "tarikh" DD/MM/YYYY HH:MM
+DEFAULT_JOBS = [
+    {"id": "laporan_jumaat", "jenis": "laporan_mingguan", "masa": "14:00", "hari": [4]},
+    {"id": "peringatan_pagi", "jenis": "peringatan", "masa": "10:00", "hari": [6, 0, 1, 2, 3, 4]},
+]
 
-    if not statistik:
-        return "Tiada data minggu ini.", []
+# Pengumuman khusus sekolah asal: hanya bagi pemasangan satu sekolah tanpa TENANTS_JSON
+LEGACY_SCHOOL_JOBS = [
+    {
+        "id": "latihan_kebakaran",
+        "jenis": "pengumuman",
+        "tarikh": "22/04/2026 08:45",
+        "mesej": (
+            "🚨 LATIHAN KEBAKARAN BERMULA 🚨\n\n"
+            "📅 22 April 2026\n"
+            "⏰ 8:45 pagi\n\n"
+            "Klik pautan di bawah:\n"
+            "https://latihankebakaran.vercel.app/\n\n"
+            "⚠️ Sila pastikan keselamatan murid-murid SK Labu Besar."
+        )
+    },
+]
 
-    ranking = []
-    for kelas, data in statistik.items():
-        percent = (data["hadir"] / data["total"]) * 100
-        ranking.append((kelas, percent))
+HARI_JOB = {"ahad": 0, "isnin": 1, "selasa": 2, "rabu": 3, "khamis": 4, "jumaat": 5, "sabtu": 6}
 
-    ranking.sort(key=lambda x: x[1], reverse=True)
+job_runs = deque(maxlen=50)
 
-    msg = "📊 Ranking Mingguan\n"
-    for i, (k, p) in enumerate(ranking):
-        msg += f"{i+1}. {k} - {p:.1f}%\n"
 
-    return msg, ranking[:3]
+def get_kehadiran_snapshot(max_age=JOB_SNAPSHOT_WINDOW):
+    """Rekod Kehadiran dikongsi antara tugasan yang berjalan dalam tempoh `max_age` saat."""
 
-def generate_monthly_summary():
+    return get_kehadiran_records(max_age)
 
-    today = get_today_malaysia()
-    one_month_ago = today - datetime.timedelta(days=30)
 
-    records = sheet_kehadiran.get_all_records()
-    statistik = {}
+def is_admin(user_id):
+    """ADMIN_IDS = pentadbir semua sekolah; admin_ids sekolah hanya bagi sekolah itu."""
+    return user_id in ADMIN_IDS or user_id in tenant().admin_ids
 
-    for r in records:
 
-        try:
-            tarikh_obj = datetime.datetime.strptime(r["Tarikh"], "%d/%m/%Y").date()
-        except:
-            continue
+def _parse_job_days(value):
+    if value in (None, ""):
+        return tuple(range(7))
+    if isinstance(value, int):
+        value = [value]
+    if isinstance(value, str):
+        value = [v for v in value.replace(";", ",").split(",") if v.strip()]
+    days = []
+    for v in value:
+        v = str(v).strip().lower()
+        days.append(HARI_JOB[v] if v in HARI_JOB else int(v))
+    return tuple(days)
 
-        if tarikh_obj < one_month_ago:
-            continue
 
-        kelas = r["Kelas"]
+# Google Sheets memaparkan masa yang ditaip sebagai "10:00:00" / "8:45:00" (kadang-kadang dengan AM/PM)
+JOB_TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%I:%M %p", "%I:%M:%S %p")
+
 
+def _parse_job_datetime(value, date_part=False):
+    """Masa ("HH:MM[:SS]") atau tarikh-masa ("DD/MM/YYYY HH:MM[:SS]") dari JSON atau sel sheet."""
+
+    value = " ".join(str(value).split()).upper()
+    for fmt in JOB_TIME_FORMATS:
         try:
-            total = int(r["Jumlah"])
-        except:
+            return datetime.datetime.strptime(value, f"%d/%m/%Y {fmt}" if date_part else fmt)
+        except ValueError:
             continue
+    raise ValueError(f"Format {'tarikh' if date_part else 'masa'} tidak dikenali: {value}")
 
-        if total <= 0:
-            continue
 
-        absent = r["Tidak Hadir"].split(", ") if r["Tidak Hadir"] else []
-        hadir = total - len(absent)
+def _normalize_job(spec):
+    """Seragamkan satu baris jadual (dari JSON atau sheet) kepada dict tugasan."""
 
-        statistik.setdefault(kelas, {"hadir": 0, "total": 0})
-        statistik[kelas]["hadir"] += hadir
-        statistik[kelas]["total"] += total
+    spec = {str(k).strip().lower(): v for k, v in spec.items()}
+    if str(spec.get("aktif", "1")).strip().lower() in ("0", "tidak", "false", "no"):
+        return None
 
-    if not statistik:
-        return "Tiada data bulan ini.", []
+    job = {
+        "id": str(spec["id"]).strip(),
+        "jenis": str(spec["jenis"]).strip().lower(),
+        "mesej": spec.get("mesej") or ""
+    }
+    if job["jenis"] not in JOB_TYPES:
+        raise ValueError(f"Jenis tugasan tidak dikenali: {job['jenis']}")
 
-    ranking = []
-    for kelas, data in statistik.items():
-        percent = (data["hadir"] / data["total"]) * 100
-        ranking.append((kelas, percent))
+    if spec.get("tarikh"):
+        job["when"] = _parse_job_datetime(spec["tarikh"], date_part=True) \
+            .replace(tzinfo=ZoneInfo("Asia/Kuala_Lumpur"))
+    else:
+        masa = _parse_job_datetime(spec["masa"])
+        job["time"] = time(masa.hour, masa.minute, masa.second, tzinfo=ZoneInfo("Asia/Kuala_Lumpur"))
+        job["days"] = _parse_job_days(spec.get("hari"))
 
-    ranking.sort(key=lambda x: x[1], reverse=True)
+    return job
 
-    msg = "📊 Ranking Bulanan\n"
-    for i, (k, p) in enumerate(ranking):
-        msg += f"{i+1}. {k} - {p:.1f}%\n"
 
-    return msg, ranking[:3]
+def load_job_specs():
+    """Sumber jadual sekolah semasa: tab sheet JOBS_SHEET (jika wujud) → fail jadual sekolah → DEFAULT_JOBS."""
 
-def calculate_1_month_trend():
+    t = tenant()
+    raw = None
+    source = "lalai"
 
-    today = get_today_malaysia()
-    one_month_ago = today - datetime.timedelta(days=30)
+    try:
+        raw = t.spreadsheet.worksheet(JOBS_SHEET).get_all_records()
+        source = f"sheet '{JOBS_SHEET}'"
+    except gspread.exceptions.WorksheetNotFound:
+        pass
 
-    records = sheet_kehadiran.get_all_records()
-    statistik = {}
+    if raw is None and os.path.exists(t.jobs_file):
+        with open(t.jobs_file, encoding="utf-8") as f:
+            raw = json.load(f)
+        source = t.jobs_file
 
-    for r in records:
+    if raw is None:
+        raw = DEFAULT_JOBS + (LEGACY_SCHOOL_JOBS if t.id == "utama" else [])
 
+    jobs = []
+    for spec in raw:
         try:
-            tarikh_obj = datetime.datetime.strptime(r["Tarikh"], "%d/%m/%Y").date()
-        except:
+            job = _normalize_job(spec)
+        except (KeyError, ValueError) as e:
+            logger.warning("Tugasan diabaikan %s: %s", spec, e)
             continue
+        if job:
+            jobs.append(job)
+    return jobs, source
 
-        if tarikh_obj < one_month_ago:
-            continue
 
-        kelas = r["Kelas"]
+def _staggered_time(t, offset):
+    """Masa harian dianjak `offset` saat (ofset sekolah) supaya bacaan Sheets tidak serentak."""
 
-        try:
-            total = int(r["Jumlah"])
-        except:
-            continue
+    shifted = datetime.datetime.combine(datetime.date(2000, 1, 1), t) + datetime.timedelta(seconds=offset)
+    return shifted.timetz()
 
-        if total <= 0:
-            continue
 
-        absent = r["Tidak Hadir"].split(", ") if r["Tidak Hadir"] else []
-        hadir = total - len(absent)
+def register_jobs(job_queue, loaded=None):
+    """Daftar (semula) semua tugasan sekolah semasa dari registry; tugasan lama dibuang dahulu."""
 
-        statistik.setdefault(kelas, {"hadir": 0, "total": 0})
-        statistik[kelas]["hadir"] += hadir
-        statistik[kelas]["total"] += total
+    t = tenant()
+    jobs, source = loaded or load_job_specs()
+    prefix = t.job_name("jadual:")
 
-    ranking = []
-    for kelas, data in statistik.items():
-        percent = (data["hadir"] / data["total"]) * 100
-        ranking.append((kelas, percent))
+    for job in job_queue.jobs():
+        if job.name and job.name.startswith(prefix):
+            job.schedule_removal()
+    now = datetime.datetime.now(ZoneInfo("Asia/Kuala_Lumpur"))
+    registered = 0
 
-    ranking.sort(key=lambda x: x[1], reverse=True)
+    for job in jobs:
+        name = prefix + job["id"]
+        data = dict(job, sekolah=t.id)
+        if "when" in job:
+            if job["when"] <= now:
+                continue
+            job_queue.run_once(run_registered_job, when=job["when"], name=name, data=data)
+        else:
+            # Pengumuman tidak membaca Sheets, jadi hanya laporan/peringatan dianjak
+            offset = 0 if job["jenis"] == "pengumuman" else t.stagger
+            job_queue.run_daily(
+                run_registered_job, time=_staggered_time(job["time"], offset),
+                days=job["days"], name=name, data=data
+            )
+        registered += 1
 
-    return ranking
+    logger.info("%s: %d tugasan didaftarkan dari %s", t.id, registered, source)
+    return registered, source
 
 
-def detect_decline_two_weeks():
+async def run_registered_job(context: ContextTypes.DEFAULT_TYPE):
+    t = enter_job_tenant(context)
+    job = context.job.data
+    t.stats["tugasan"] += 1
+    started = time_module.monotonic()
+    status, error = "ok", None
 
-    records = sheet_kehadiran.get_all_records()
-    statistik = {}
+    try:
+        async with profile_section(f"job:{job['id']}"):
+            await JOB_TYPES[job["jenis"]](context)
+    except Exception as e:
+        status, error = "gagal", repr(e)
+        logger.exception("Tugasan %s gagal", job["id"])
+
+    entry = {
+        "id": job["id"],
+        "sekolah": t.id,
+        "jenis": job["jenis"],
+        "mula": datetime.datetime.now(ZoneInfo("Asia/Kuala_Lumpur")).isoformat(timespec="seconds"),
+        "saat": round(time_module.monotonic() - started, 3),
+        "status": status,
+        "ralat": error
+    }
+    job_runs.append(entry)
 
-    for r in records:
-        kelas = r["Kelas"]
+    try:
+        with open(JOB_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError:
+        logger.exception("Gagal menulis log tugasan")
 
-        try:
-            total = int(r["Jumlah"])
-        except (ValueError, TypeError):
-            continue
 
-        if total <= 0:
+async def reload_jobs_job(context: ContextTypes.DEFAULT_TYPE):
+    for t in all_tenants():
+        if not t.sheets_ready.is_set():
             continue
+        set_tenant(t)
+        try:
+            register_jobs(context.job_queue, await asyncio.to_thread(load_job_specs))
+        except Exception:
+            logger.exception("Gagal memuat semula jadual %s", t.id)
 
-        absent = r["Tidak Hadir"].split(", ") if r["Tidak Hadir"] else []
-        hadir = total - len(absent)
 
-        percent = (hadir / total) * 100
+async def jadual_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/jadual – senarai tugasan & larian terkini; /jadual muat – muat semula registry."""
 
-        statistik.setdefault(kelas, []).append(percent)
+    if not is_admin(update.effective_user.id):
+        return
+
+    if not await ensure_ready():
+        await outbox.reply(update.message, "⏳ Sistem sedang dimulakan. Sila cuba sebentar lagi.")
+        return
+
+    if context.args and context.args[0].lower() == "muat":
+        registered, source = register_jobs(context.job_queue, await asyncio.to_thread(load_job_specs))
+        await outbox.reply(update.message, f"🔄 {registered} tugasan dimuat semula dari {source}.")
+        return
+
+    t = tenant()
+    prefix = t.job_name("jadual:")
+    msg = f"🗓 Tugasan Berjadual — {t.nama}\n\n"
+    for job in context.job_queue.jobs():
+        if job.name and job.name.startswith(prefix):
+            next_run = job.next_t.astimezone(ZoneInfo("Asia/Kuala_Lumpur")).strftime("%d/%m %H:%M") if job.next_t else "-"
+            msg += f"• {job.name[len(prefix):]} ({job.data['jenis']}) → {next_run}\n"
+
+    runs = [r for r in job_runs if r.get("sekolah") == t.id]
+    if runs:
+        msg += "\n📜 Larian Terkini\n"
+        for r in runs[-10:]:
+            icon = "✅" if r["status"] == "ok" else "❌"
+            msg += f"{icon} {r['id']} {r['mula'][5:16]} ({r['saat']}s)\n"
+
+    await outbox.reply(update.message, msg)
 
-    decline = []
-    for kelas, values in statistik.items():
-        if len(values) >= 2 and values[-1] < values[-2]:
-            decline.append(kelas)
 
-    return decline
 # ======================
-# MENU BUTTON HANDLER
+# 🚀 PERMULAAN & HEALTH CHECK
 # ======================
-async def handle_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.text.strip() == "🏠 Menu Utama":
-        user_state.pop(update.message.from_user.id, None)
-        await start(update, context)
-
-    elif update.message.text.strip() == "📊 Dashboard":
-        await update.message.reply_text(
-            "📊 Klik link di bawah untuk buka dashboard:\n\nhttps://dashboardkehadiran.vercel.app/"
-        )
+async def ensure_ready(timeout=STARTUP_WAIT):
+    """Tunggu sambungan sheet sekolah semasa sedia (hanya berlaku dalam beberapa saat pertama selepas mula)."""
 
-async def auto_send_friday_report(context: ContextTypes.DEFAULT_TYPE):
+    sheets_ready = tenant().sheets_ready
+    if sheets_ready.is_set():
+        return True
+    try:
+        await asyncio.wait_for(sheets_ready.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
 
-    summary, top3 = generate_weekly_summary()
-    decline = detect_decline_two_weeks()
 
-    msg = "📡 LAPORAN KEHADIRAN MINGGUAN\n\n"
+def warm_caches():
+    startup_state = tenant().startup_state
+    t0 = time_module.monotonic()
+    get_murid_records(max_age=0)
+    get_kehadiran_snapshot(max_age=0)
+    startup_state["masa"]["cache"] = round(time_module.monotonic() - t0, 3)
+    startup_state["cache_sedia"] = True
 
-    if top3:
-        msg += "🏆 Top 3 Mingguan\n"
-        for i, (k, p) in enumerate(top3):
-            medal = ["🥇","🥈","🥉"][i]
-            msg += f"{medal} {k} - {p:.1f}%\n"
-        msg += "\n"
 
-    msg += summary
+async def startup_tenant(app, t):
+    """Fasa permulaan satu sekolah di latar belakang: bot terus menerima update sementara sheet & cache dimuat."""
 
-    if decline:
-        msg += "\n\n⬇️ Kehadiran Menurun:\n"
-        for k in decline:
-            msg += f"⚠️ {k}\n"
+    set_tenant(t)
+    startup_state = t.startup_state
 
-    await context.bot.send_message(chat_id=GROUP_ID, text=msg)
+    # Sekolah dibuka berselang (dalam 30 saat) supaya permintaan awal tidak serentak
+    await asyncio.sleep((t.index * 2) % 30)
 
-# ======================
-# 🔔 AUTO REMINDER 9:45 PAGI
-# ======================
+    t0 = time_module.monotonic()
+    delay = 5
 
-async def auto_reminder_unupdated_classes(context: ContextTypes.DEFAULT_TYPE):
+    while True:
+        try:
+            await asyncio.to_thread(init_sheets, t)
+            break
+        except Exception as e:
+            startup_state["ralat"] = repr(e)
+            logger.exception("%s: gagal membuka Google Sheet, cuba semula dalam %ds", t.id, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 300)
 
-    today = get_today_malaysia()
-    tarikh = today.strftime("%d/%m/%Y")
+    startup_state["ralat"] = None
+    t.sheets_ready.set()
 
-    records = sheet_kehadiran.get_all_records()
+    # Segerak simpanan yang tertangguh (termasuk dari sebelum bot dimulakan semula)
+    t.journal.load()
+    t.journal.wakeup.set()
+    app.create_task(journal_replay_loop(t))
+    logger.info("%s: sheet sedia dalam %.2fs (%s)", t.id, time_module.monotonic() - t0, startup_state["masa"])
 
-    recorded = set()
-    for r in records:
-        if r["Tarikh"] == tarikh:
-            recorded.add(r["Kelas"].strip().lower())
+    try:
+        assigned = await asyncio.to_thread(ensure_student_ids)
+        if assigned:
+            logger.info("%s: %d murid baharu diberi ID", t.id, assigned)
+    except Exception:
+        logger.exception("%s: gagal memberi ID murid", t.id)
 
-    belum_update = [
-        k for k in ALL_CLASSES
-        if k.strip().lower() not in recorded
-    ]
+    try:
+        await asyncio.to_thread(warm_caches)
+    except Exception:
+        logger.exception("%s: gagal memuat cache awal", t.id)
 
-    if not belum_update:
-        # Semua dah update, tak perlu hantar apa-apa
-        return
+    try:
+        register_jobs(app.job_queue, await asyncio.to_thread(load_job_specs))
+    except Exception:
+        logger.exception("%s: gagal mendaftar tugasan berjadual", t.id)
 
-    msg = (
-        "⏰ PERINGATAN PENGISIAN KEHADIRAN KELAS \n\n"
-        f"📅 {tarikh}\n\n"
-        "Kelas berikut masih belum mengisi kehadiran:\n\n"
+    app.job_queue.run_once(
+        dashboard_snapshot_job, when=t.stagger, name=t.job_name("dashboard_snapshot"), data={"sekolah": t.id}
     )
 
-    for i, kelas in enumerate(belum_update, 1):
-        msg += f"{i}. {kelas}\n"
+    startup_state["masa"]["jumlah"] = round(time_module.monotonic() - t0, 3)
+    logger.info("%s: permulaan lengkap dalam %.2fs", t.id, startup_state["masa"]["jumlah"])
+
+
+async def startup(app):
+    for t in all_tenants():
+        app.create_task(startup_tenant(app, t))
+
+
+async def post_init(app):
+    for t in all_tenants():
+        if t.group_id is None:
+            logger.warning("%s: group_id tidak ditetapkan; mesej group tidak akan dihantar", t.id)
+    app.create_task(startup(app))
 
-    msg += "\n⚠️ Mohon guru semasa ambil tindakan segera.\n\n"
-    msg += "\n Mesej ini dijana secara automatik.\n\n"
-    msg += "📊 Sistem Tracker Kehadiran SK Labu Besar"
 
+def tenant_metrics(t):
+    token = set_tenant(t)
     try:
-        await context.bot.send_message(chat_id=GROUP_ID, text=msg)
-    except Exception:
-        pass
+        return {
+            "nama": t.nama,
+            "sedia": t.sheets_ready.is_set(),
+            "cache_sedia": t.startup_state["cache_sedia"],
+            "ralat": t.startup_state["ralat"],
+            "masa_mula": t.startup_state["masa"],
+            "kiraan": t.stats,
+            "jurnal": t.journal.metrics(),
+            "cache_respons": t.response_cache.metrics(),
+            "kiub": t.cube.metrics(),
+            "segerak_sheet": sync_metrics()
+        }
+    finally:
+        _current_tenant.reset(token)
 
-async def send_fire_drill_link(context: ContextTypes.DEFAULT_TYPE):
 
-    msg = (
-        "🚨 LATIHAN KEBAKARAN BERMULA 🚨\n\n"
-        "📅 22 April 2026\n"
-        "⏰ 8:45 pagi\n\n"
-        "Klik pautan di bawah:\n"
-        "https://latihankebakaran.vercel.app/\n\n"
-        "⚠️ Sila pastikan keselamatan murid-murid SK Labu Besar."
-    )
+def health_status(tenants=None):
+    tenants = tenants or all_tenants()
+    return {
+        "sedia": all(t.sheets_ready.is_set() for t in tenants),
+        "mesej_keluar": outbox.metrics(),
+        "sekolah": {t.id: tenant_metrics(t) for t in tenants},
+        "uptime_saat": round(time_module.time() - BOT_STARTED)
+    }
+
+
+async def health_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Pentadbir utama melihat semua sekolah; pengguna lain hanya sekolah sendiri
+    status = health_status(None if update.effective_user.id in ADMIN_IDS else [tenant()])
+    icon = "✅" if status["sedia"] else "⏳"
+    await outbox.reply(update.message, f"{icon} Status Bot\n\n" + json.dumps(status, indent=2, ensure_ascii=False))
+
 
-    await context.bot.send_message(
-        chat_id=GROUP_ID,
-        text=msg
-    )
 # ======================
 # MAIN
 # ======================
 
 
-def main():
-    app = ApplicationBuilder().token(TOKEN).build()
-
-    # Auto Jumaat 2PM (Malaysia Time)
-    
-    FRIDAY = 4
-    
-    app.job_queue.run_daily(
-        auto_send_friday_report,
-        time=time(14, 0, tzinfo=ZoneInfo("Asia/Kuala_Lumpur")),
-        days=(FRIDAY,)
-    )
+def build_application(builder=None):
+    """Bina Application lengkap dengan handler & tugasan (juga dipakai loadtest.py)."""
+    if builder is None:
+        builder = ApplicationBuilder().token(TOKEN)
+    app = builder.post_init(post_init).build()
 
-    # Auto Reminder 9:45 pagi (Isnin - Jumaat)
+    # Tugasan berjadual didaftar dalam startup() sebaik sahaja sheet sedia
 
-    app.job_queue.run_daily(
-        auto_reminder_unupdated_classes,
-        time=time(10, 00, tzinfo=ZoneInfo("Asia/Kuala_Lumpur")),
-        days=(6,0,1,2,3,4)
-    )
+    app.job_queue.run_repeating(reload_jobs_job, interval=JOBS_RELOAD_INTERVAL, first=JOBS_RELOAD_INTERVAL)
 
-    from datetime import datetime
+    # Snapshot dashboard selepas tengah malam (tukar hari), berselang antara sekolah
 
-    app.job_queue.run_once(
-        send_fire_drill_link,
-        when=datetime(2026, 4, 22, 8, 45, tzinfo=ZoneInfo("Asia/Kuala_Lumpur"))
-    )
+    for t in all_tenants():
+        app.job_queue.run_daily(
+            dashboard_snapshot_job,
+            time=_staggered_time(time(0, 5, tzinfo=ZoneInfo("Asia/Kuala_Lumpur")), t.stagger),
+            name=t.job_name("dashboard_harian"),
+            data={"sekolah": t.id}
+        )
 
+    # Setiap update diproses dalam konteks sekolahnya (kumpulan -1 berjalan dahulu)
+    app.add_handler(TypeHandler(Update, tenant_gate), group=-1)
+    app.add_handler(CommandHandler("sekolah", sekolah_command))
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("eksport", eksport_command))
+    app.add_handler(CommandHandler("jadual", jadual_command))
+    app.add_handler(CommandHandler("health", health_command))
+    app.add_handler(CommandHandler("profil", profil_command))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu_button))
+    return app
+
+
+def main():
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.INFO)
+
+    app = build_application()
 
     print("🤖 Bot Kehadiran Smart 4.0 berjalan...")
     app.run_polling(drop_pending_updates=True)
 
 
+# ======================
+# CLI
+# ======================
+def cli(argv=None):
+    parser = argparse.ArgumentParser(prog="kehadiran.py", description="Alat pentadbiran Tracker Kehadiran")
+    parser.add_argument("--sekolah", help="ID sekolah (wajib jika TENANTS_JSON mengandungi lebih dari satu sekolah)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_arkib = sub.add_parser("arkib", help="Pindahkan rekod lama dari sheet Kehadiran ke arkib")
+    group = p_arkib.add_mutually_exclusive_group(required=True)
+    group.add_argument("--tahun", type=int, help="Arkibkan semua rekod sehingga akhir tahun ini")
+    group.add_argument("--sebelum", help="Arkibkan rekod sebelum tarikh DD/MM/YYYY (cth. akhir penggal)")
+    p_arkib.add_argument("--sheet", action="store_true", help="Salin juga ke worksheet 'Arkib YYYY'")
+    p_arkib.add_argument("--dry-run", action="store_true")
+
+    p_import = sub.add_parser("import", help="Import pukal rekod kehadiran dari CSV / JSON / JSON Lines")
+    p_import.add_argument("files", nargs="+")
+    p_import.add_argument("--saiz-batch", type=int, default=IMPORT_BATCH_SIZE)
+    p_import.add_argument("--ditolak", help="Tulis rekod yang ditolak (beserta sebab) ke fail CSV ini")
+    p_import.add_argument("--dry-run", action="store_true")
+
+    p_eksport = sub.add_parser("eksport", help="Eksport rekod bagi julat tarikh ke CSV / JSON Lines")
+    p_eksport.add_argument("--dari", required=True, help="DD/MM/YYYY")
+    p_eksport.add_argument("--hingga", required=True, help="DD/MM/YYYY")
+    p_eksport.add_argument("--kelas", action="append", help="Boleh diulang; lalai semua kelas")
+    p_eksport.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    p_eksport.add_argument("--per-murid", action="store_true", help="Satu baris bagi setiap murid tidak hadir")
+    p_eksport.add_argument("-o", "--output", help="Fail output (lalai: stdout)")
+
+    sub.add_parser("jana-id", help="Beri ID stabil kepada murid yang belum ada ID dalam Senarai Murid")
+
+    p_baiki = sub.add_parser("baiki-duplikat", help="Gabung rekod berganda (Kelas, Tarikh) dalam sheet Kehadiran")
+    p_baiki.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args(argv)
+
+    tenants = all_tenants()
+    if args.sekolah:
+        if args.sekolah not in TENANTS:
+            parser.error(f"Sekolah tidak dikenali: {args.sekolah} (ada: {', '.join(TENANTS)})")
+        set_tenant(TENANTS[args.sekolah])
+    elif len(tenants) > 1:
+        parser.error(f"Nyatakan --sekolah ({', '.join(TENANTS)})")
+    init_sheets()
+
+    if args.command == "arkib":
+        cutoff = datetime.date(args.tahun + 1, 1, 1) if args.tahun else parse_tarikh(args.sebelum)
+        if cutoff is None:
+            parser.error("Format tarikh mesti DD/MM/YYYY")
+
+        try:
+            count = archive_before(cutoff, to_sheet=args.sheet or ARCHIVE_SHEETS, dry_run=args.dry_run)
+        except ValueError as e:
+            parser.error(str(e))
+        action = "akan diarkibkan" if args.dry_run else "diarkibkan"
+        print(f"🗄 {count} rekod sebelum {cutoff.strftime('%d/%m/%Y')} {action}.")
+
+    elif args.command == "import":
+        stats = bulk_import(args.files, batch_size=args.saiz_batch, dry_run=args.dry_run, rejected_path=args.ditolak)
+        print(
+            f"📥 Dibaca {stats['dibaca']} | Diterima {stats['diterima']} | Ditolak {stats['ditolak']} | "
+            f"{stats['batch']} batch | {stats['saat']}s ({stats['rekod_sesaat']} rekod/s)"
+        )
+
+    elif args.command == "eksport":
+        start, end = parse_tarikh(args.dari), parse_tarikh(args.hingga)
+        if start is None or end is None:
+            parser.error("Format tarikh mesti DD/MM/YYYY")
+
+        rows = iter_export_rows(start, end, args.kelas, args.per_murid)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8", newline="") as f:
+                count = write_export(f, rows, args.format, args.per_murid)
+            print(f"📤 {count} baris ditulis ke {args.output}", file=sys.stderr)
+        else:
+            write_export(sys.stdout, rows, args.format, args.per_murid)
+
+    elif args.command == "jana-id":
+        print(f"🆔 {ensure_student_ids()} murid diberi ID baharu.")
+
+    elif args.command == "baiki-duplikat":
+        groups, rows = repair_duplicates(dry_run=args.dry_run)
+        action = "akan dipadam" if args.dry_run else "dipadam"
+        print(f"🧹 {groups} rekod berganda ditemui; {rows} baris lebihan {action}.")
+
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        cli()
+    else:
+        main()
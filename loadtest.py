@@ -0,0 +1,492 @@
+"""
+Penjana beban waktu puncak pagi untuk bot kehadiran.
+
+Mensimulasikan ramai guru merekod kehadiran serentak: setiap update Telegram sintetik
+dihantar melalui Application.process_update (handler sebenar dari kehadiran.py),
+manakala Bot API dan Google Sheets digantikan dengan palsu berlatensi boleh laras.
+
+Contoh:
+    python loadtest.py --guru 20 --serentak 1
+    python loadtest.py --guru 60 --serentak 8 --latensi-sheet 0.4 --json
+"""
+
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import tempfile
+import logging
+import warnings
+import time as time_module
+from collections import Counter, defaultdict
+
+# Jurnal & fail sampingan ke direktori sementara sebelum kehadiran diimport
+_TMP = tempfile.mkdtemp(prefix="kehadiran-loadtest-")
+os.environ.setdefault("TOKEN", "123456:LOADTEST")
+os.environ["JOURNAL_PATH"] = os.path.join(_TMP, "jurnal.jsonl")
+os.environ["JOB_LOG_PATH"] = os.path.join(_TMP, "jadual_log.jsonl")
+os.environ["DASHBOARD_SNAPSHOT_PATH"] = os.path.join(_TMP, "snapshot.json")
+os.environ["REPORT_CACHE_DIR"] = os.path.join(_TMP, "laporan")
+
+import gspread
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest
+from telegram.warnings import PTBUserWarning
+
+import kehadiran as K
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+# ======================
+# 📄 GOOGLE SHEETS PALSU
+# ======================
+class FakeWorksheet:
+    """Worksheet dalam memori dengan latensi setiap panggilan API (sekat thread seperti gspread)."""
+
+    def __init__(self, spreadsheet, title, header, rows, latency):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.header = list(header)
+        self.rows = [list(r) for r in rows]
+        self.latency = latency
+
+    def _call(self, name):
+        self.spreadsheet.calls[f"{self.title}.{name}"] += 1
+        if name not in ("get_all_values", "get_all_records", "get_values", "acell"):
+            self.spreadsheet.revision += 1
+        if self.latency:
+            time_module.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+    def _padded(self, row):
+        return [str(v) for v in row] + [""] * (len(self.header) - len(row))
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        return [list(self.header)] + [self._padded(r) for r in self.rows]
+
+    def get_values(self, range_name):
+        self._call("get_values")
+        start, end = range_name.split(":")
+        row, col = gspread.utils.a1_to_rowcol(start)
+        width = gspread.utils.a1_to_rowcol(end + "1")[1] if end.isalpha() else gspread.utils.a1_to_rowcol(end)[1]
+        last = len(self.rows) + 1 if end.isalpha() else gspread.utils.a1_to_rowcol(end)[0]
+        values = [([self.header] + self.rows)[r - 1][col - 1:width] for r in range(row, min(last, len(self.rows) + 1) + 1)]
+        return values or [[]]
+
+    def get_all_records(self):
+        self._call("get_all_records")
+        out = []
+        for row in self.rows:
+            record = {}
+            for h, v in zip(self.header, self._padded(row)):
+                record[h] = int(v) if v.isdigit() else v
+            out.append(record)
+        return out
+
+    def acell(self, label):
+        self._call("acell")
+        row, col = gspread.utils.a1_to_rowcol(label)
+        values = [self.header] + self.rows
+        value = values[row - 1][col - 1] if row <= len(values) and col <= len(values[row - 1]) else None
+        return type("Cell", (), {"value": value})()
+
+    def update_cell(self, row, col, value):
+        self._call("update_cell")
+        self._set(row, col, value)
+
+    def update_acell(self, label, value):
+        self._call("update_acell")
+        self._set(*gspread.utils.a1_to_rowcol(label), value)
+
+    def update(self, range_name, values):
+        self._call("update")
+        row, col = gspread.utils.a1_to_rowcol(range_name.split(":")[0])
+        for i, vals in enumerate(values):
+            for j, v in enumerate(vals):
+                self._set(row + i, col + j, v)
+
+    def append_row(self, values):
+        self._call("append_row")
+        self.rows.append([str(v) for v in values])
+
+    def append_rows(self, values):
+        self._call("append_rows")
+        self.rows.extend([str(v) for v in vals] for vals in values)
+
+    def delete_rows(self, start, end=None):
+        self._call("delete_rows")
+        del self.rows[start - 2:(end or start) - 1]
+
+    def _set(self, row, col, value):
+        target = self.header if row == 1 else self.rows[row - 2]
+        while len(target) < col:
+            target.append("")
+        target[col - 1] = str(value)
+        if row == 1:
+            for r in self.rows:
+                r.extend([""] * (len(self.header) - len(r)))
+
+
+class FakeSpreadsheet:
+
+    def __init__(self, latency):
+        self.calls = Counter()
+        self.sheets = {}
+        self.latency = latency
+        self.revision = 0
+
+    def get_lastUpdateTime(self):
+        self.calls["get_lastUpdateTime"] += 1
+        return f"rev-{self.revision}"
+
+    def add(self, title, header, rows=()):
+        self.sheets[title] = FakeWorksheet(self, title, header, rows, self.latency)
+        return self.sheets[title]
+
+    def worksheets(self):
+        return list(self.sheets.values())
+
+    def worksheet(self, title):
+        self.calls["worksheet"] += 1
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+
+def build_fake_spreadsheet(latency, per_kelas, seed):
+    rng = random.Random(seed)
+    book = FakeSpreadsheet(latency)
+    murid = []
+    for kelas in K.tenant().classes:
+        for i in range(per_kelas + rng.randint(-3, 3)):
+            nama = f"MURID {kelas.upper()} {i + 1:02d}"
+            murid.append([kelas, nama, "RMT" if rng.random() < 0.15 else ""])
+    book.add("Senarai Murid", ["Kelas", "Nama Murid", "Catatan"], murid)
+    book.add("Kehadiran", ["Tarikh", "Hari", "Kelas", "Hadir", "Jumlah", "Tidak Hadir", "ID Tidak Hadir"])
+    return book
+
+
+# ======================
+# 🤖 BOT API PALSU
+# ======================
+class FakeRequest(BaseRequest):
+    """Backend HTTP palsu untuk Bot API: kira panggilan & simpan papan kekunci terakhir setiap chat."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+        self.keyboards = {}
+        self.message_id = 1000
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, text=None, reply_markup=None):
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time_module.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+        }
+        if text is not None:
+            message["text"] = text
+        if reply_markup is not None:
+            message["reply_markup"] = reply_markup
+        return message
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+
+        if self.latency and endpoint != "getMe":
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Kehadiran", "username": "kehadiran_bot"}
+        elif endpoint in ("answerCallbackQuery", "deleteWebhook"):
+            result = True
+        elif endpoint in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            markup = params.get("reply_markup")
+            if isinstance(markup, str):
+                markup = json.loads(markup)
+            if not isinstance(markup, dict) or "inline_keyboard" not in markup:
+                markup = None  # papan kekunci balasan tidak dikembalikan dalam Message
+            self.keyboards[chat_id] = markup
+            result = self._message(chat_id, params.get("text"), markup)
+        else:
+            result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def buttons(self, chat_id, prefix=""):
+        markup = self.keyboards.get(chat_id) or {}
+        return [
+            b["callback_data"]
+            for row in markup.get("inline_keyboard", [])
+            for b in row
+            if b.get("callback_data", "").startswith(prefix)
+        ]
+
+
+# ======================
+# 👩‍🏫 GURU SINTETIK
+# ======================
+class LoadRun:
+
+    def __init__(self, app, request, args):
+        self.app = app
+        self.request = request
+        self.args = args
+        self.update_id = 0
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.started = None
+
+    def _update(self, user_id, data=None, text=None):
+        self.update_id += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"Guru {user_id}"}
+        message = {
+            "message_id": self.update_id,
+            "date": int(time_module.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+        }
+        if text is not None:
+            return Update.de_json({"update_id": self.update_id, "message": {**message, "text": text}}, self.app.bot)
+
+        return Update.de_json({
+            "update_id": self.update_id,
+            "callback_query": {
+                "id": str(self.update_id), "from": user, "chat_instance": str(user_id),
+                "data": data, "message": {**message, "text": "-"}
+            }
+        }, self.app.bot)
+
+    async def send(self, user_id, data=None, text=None):
+        """Hantar satu update seperti Application sebenar (melalui update_processor & had serentak)."""
+
+        update = self._update(user_id, data, text)
+        action = (data or text).split("|")[0]
+        t0 = time_module.perf_counter()
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+        self.latencies[action].append(time_module.perf_counter() - t0)
+
+    async def think(self):
+        if self.args.jeda:
+            await asyncio.sleep(random.expovariate(1 / self.args.jeda))
+
+    async def teacher(self, user_id, kelas):
+        await asyncio.sleep(random.uniform(0, self.args.tempoh_mula))
+
+        await self.send(user_id, text="🏠 Menu Utama")
+        await self.think()
+        await self.send(user_id, data="rekod")
+        await self.think()
+        await self.send(user_id, data=f"kelas|{kelas}")
+        await self.record_once(user_id)
+
+        if random.random() < self.args.peratus_overwrite / 100:
+            # Guru membetulkan rekod: buka semula kelas, tukar, simpan & sahkan tulis ganti
+            await self.think()
+            await self.send(user_id, data=f"kelas|{kelas}")
+            await self.record_once(user_id)
+            confirm = self.request.buttons(user_id, "confirm_overwrite|")
+            if confirm:
+                await self.think()
+                await self.send(user_id, data=confirm[0])
+
+        if random.random() < self.args.peratus_semak / 100:
+            await self.think()
+            await self.send(user_id, data="semak")
+            await self.think()
+            await self.send(user_id, data=f"semak_kelas|{kelas}")
+            days = self.request.buttons(user_id, "semak_tarikh|")
+            if days:
+                await self.think()
+                await self.send(user_id, data=random.choice(days))
+
+    async def record_once(self, user_id):
+        students = self.request.buttons(user_id, "murid|")
+        for data in random.sample(students, min(len(students), random.randint(0, 4))):
+            await self.think()
+            await self.send(user_id, data=data)
+
+        save = self.request.buttons(user_id, "simpan|") or self.request.buttons(user_id, "semua_hadir|")
+        if save:
+            await self.think()
+            await self.send(user_id, data=save[0])
+
+    async def run(self):
+        self.started = time_module.perf_counter()
+        classes = K.tenant().classes
+        await asyncio.gather(*(
+            self.teacher(10_000 + i, classes[i % len(classes)])
+            for i in range(self.args.guru)
+        ))
+        elapsed = time_module.perf_counter() - self.started
+
+        # Tunggu jurnal selesai disegerak ke Sheets (lag penulisan latar)
+        t0 = time_module.perf_counter()
+        while K.tenant().journal.pending() and time_module.perf_counter() - t0 < self.args.had_segerak:
+            await asyncio.sleep(0.05)
+        return elapsed, time_module.perf_counter() - t0
+
+
+# ======================
+# 📈 LAPORAN
+# ======================
+def build_report(run, book, elapsed, sync_lag):
+    all_latencies = [v for values in run.latencies.values() for v in values]
+    total = len(all_latencies)
+
+    per_action = {}
+    for action, values in sorted(run.latencies.items()):
+        per_action[action] = {
+            "bilangan": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+        }
+
+    saved = Counter((r[0], r[2]) for r in book.sheets["Kehadiran"].rows)
+    return {
+        "guru": run.args.guru,
+        "serentak": run.args.serentak,
+        "tempoh_s": round(elapsed, 2),
+        "update": total,
+        "update_sesaat": round(total / elapsed, 1) if elapsed else 0,
+        "latensi_ms": {
+            "p50": round(percentile(all_latencies, 50) * 1000, 1),
+            "p95": round(percentile(all_latencies, 95) * 1000, 1),
+            "p99": round(percentile(all_latencies, 99) * 1000, 1),
+            "maks": round(max(all_latencies, default=0) * 1000, 1),
+        },
+        "ikut_tindakan": per_action,
+        "ralat": dict(run.errors),
+        "kadar_ralat": round(sum(run.errors.values()) / total, 4) if total else 0,
+        "panggilan_sheets": dict(book.calls),
+        "panggilan_bot": dict(run.request.calls),
+        "baris_kehadiran": sum(saved.values()),
+        "baris_pendua": sum(n - 1 for n in saved.values() if n > 1),
+        "jurnal_tertunggak": len(K.tenant().journal.pending()),
+        "lag_segerak_s": round(sync_lag, 2),
+        "outbox": K.outbox.metrics(),
+    }
+
+
+def print_report(report):
+    print(f"\n=== Beban pagi: {report['guru']} guru, serentak={report['serentak']} ===")
+    print(f"Tempoh        : {report['tempoh_s']}s, {report['update']} update ({report['update_sesaat']}/s)")
+    lat = report["latensi_ms"]
+    print(f"Latensi (ms)  : p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} maks={lat['maks']}")
+    print(f"Ralat         : {report['kadar_ralat']:.2%} {report['ralat'] or ''}")
+    print(f"Kehadiran     : {report['baris_kehadiran']} baris, {report['baris_pendua']} pendua, "
+          f"{report['jurnal_tertunggak']} tertunggak (lag segerak {report['lag_segerak_s']}s)")
+
+    print("\nTindakan             n      p50     p95     p99")
+    for action, s in report["ikut_tindakan"].items():
+        print(f"{action:<18} {s['bilangan']:>5} {s['p50_ms']:>8} {s['p95_ms']:>7} {s['p99_ms']:>7}")
+
+    print("\nPanggilan Sheets:")
+    for name, n in sorted(report["panggilan_sheets"].items()):
+        print(f"  {name:<32} {n}")
+    print("Panggilan Bot API:")
+    for name, n in sorted(report["panggilan_bot"].items()):
+        print(f"  {name:<32} {n}")
+
+
+# ======================
+# MAIN
+# ======================
+async def run_load(args):
+    random.seed(args.benih)
+    book = build_fake_spreadsheet(args.latensi_sheet, args.murid_sekelas, args.benih)
+    request = FakeRequest(args.latensi_bot)
+
+    builder = (
+        ApplicationBuilder()
+        .token(os.environ["TOKEN"])
+        .request(request)
+        .get_updates_request(FakeRequest(0))
+        .concurrent_updates(args.serentak)
+    )
+    app = K.build_application(builder)
+
+    run = LoadRun(app, request, args)
+
+    async def on_error(update, context):
+        run.errors[type(context.error).__name__] += 1
+
+    app.add_error_handler(on_error)
+
+    # Gantikan pembukaan Google Sheet dengan spreadsheet palsu; selebihnya startup_tenant() sebenar
+    def init_fake_sheets(t=None):
+        t = t or K.tenant()
+        t.spreadsheet = book
+        t.sheet_murid = book.sheets["Senarai Murid"]
+        t.sheet_kehadiran = book.sheets["Kehadiran"]
+
+    K.init_sheets = init_fake_sheets
+    t = K.tenant()
+    t.group_id = args.group_id
+
+    await app.initialize()
+    await K.startup_tenant(app, t)
+    book.calls.clear()
+
+    try:
+        elapsed, sync_lag = await run.run()
+    finally:
+        await app.shutdown()
+
+    return build_report(run, book, elapsed, sync_lag)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Penjana beban waktu puncak pagi (Telegram & Sheets palsu)")
+    parser.add_argument("--guru", type=int, default=20, help="bilangan guru serentak")
+    parser.add_argument("--serentak", type=int, default=1,
+                        help="had update diproses serentak (ApplicationBuilder.concurrent_updates)")
+    parser.add_argument("--latensi-sheet", type=float, default=0.25, help="purata latensi panggilan Sheets (s)")
+    parser.add_argument("--latensi-bot", type=float, default=0.08, help="purata latensi Bot API (s)")
+    parser.add_argument("--jeda", type=float, default=0.5, help="purata masa fikir guru antara klik (s)")
+    parser.add_argument("--tempoh-mula", type=float, default=5.0, help="guru mula secara rawak dalam tempoh ini (s)")
+    parser.add_argument("--peratus-overwrite", type=float, default=15)
+    parser.add_argument("--peratus-semak", type=float, default=20)
+    parser.add_argument("--murid-sekelas", type=int, default=30)
+    parser.add_argument("--group-id", type=int, default=-1001, help="chat group laporan (0 = tiada)")
+    parser.add_argument("--had-segerak", type=float, default=60, help="masa maksimum menunggu jurnal kosong (s)")
+    parser.add_argument("--benih", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="cetak laporan sebagai JSON")
+    args = parser.parse_args(argv)
+    args.group_id = args.group_id or None
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.WARNING)
+    warnings.filterwarnings("ignore", category=PTBUserWarning)
+    report = asyncio.run(run_load(args))
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 1 if report["kadar_ralat"] or report["baris_pendua"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())